@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+End-to-end benchmarks of `ChimeraSelectionEntry` against the synthetic
+`chimera` stand-in in `fakechimera/`, on the stub Tk backend.
+
+    python benchmarks/bench_chimera.py [--sizes 10000,100000,1000000] [--fraction 0.01] [-o results.json]
+
+For each system size (in atoms), it times entry creation, `desaturate`,
+`resaturate`, `depict` and `undo_depict` of a `fraction` of the atoms,
+and `on_selection_changed` after selecting that same fraction. Emits
+JSON with min/median latencies in ms.
+"""
+
+from __future__ import print_function, division
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [HERE, os.path.join(HERE, 'fakechimera'), os.path.join(HERE, '..')]
+import faketk
+faketk.install()
+import chimera
+import chimera.synthetic
+from selectionwidget.gui import ChimeraSelectionEntry
+
+
+def load_system(n_atoms, models=1):
+    chimera.triggers = chimera.TriggerSet()
+    chimera.openModels.reset()
+    chimera.selection.clearCurrent()
+    molecules = chimera.synthetic.build_system(n_atoms, models=models)
+    chimera.openModels.add(molecules)
+    return molecules
+
+
+def sample(molecules, fraction):
+    atoms = [a for m in molecules for a in m.atoms]
+    step = max(1, int(round(1 / fraction)))
+    return atoms[::step]
+
+
+def new_entry():
+    entry = ChimeraSelectionEntry(mode='atoms', respond_to_focus=False)
+    return entry
+
+
+def measure(setup, run, repeat):
+    times = []
+    for _ in range(repeat):
+        state = setup()
+        t0 = time.time()
+        run(state)
+        times.append((time.time() - t0) * 1000)
+        if isinstance(state, dict) and 'entry' in state:
+            state['entry'].destroy()
+    times.sort()
+    return {'min_ms': times[0], 'median_ms': times[len(times) // 2], 'repeat': repeat}
+
+
+def run(sizes, fraction=0.01, repeat=None, models=1):
+    results = []
+    for n in sizes:
+        r = repeat or (1 if n >= 10 ** 6 else 3)
+        molecules = load_system(n, models=models)
+        atoms = sample(molecules, fraction)
+
+        def fresh():
+            chimera.selection.clearCurrent()
+            entry = new_entry()
+            return {'entry': entry}
+
+        def desaturated():
+            state = fresh()
+            state['entry'].desaturate()
+            return state
+
+        def with_items():
+            state = desaturated()
+            entry = state['entry']
+            state['items'] = [entry.create_item(obj=a) for a in atoms]
+            for item in state['items']:
+                entry.register_item(item)
+            return state
+
+        def depicted():
+            state = with_items()
+            state['entry'].depict(*state['items'])
+            return state
+
+        def selected():
+            state = desaturated()
+            chimera.selection.addCurrent(atoms)
+            return state
+
+        cases = (
+            ('entry_init', lambda: None, lambda s: new_entry().destroy()),
+            ('desaturate', fresh, lambda s: s['entry'].desaturate()),
+            ('resaturate', desaturated, lambda s: s['entry'].resaturate()),
+            ('depict', with_items, lambda s: s['entry'].depict(*s['items'])),
+            ('undo_depict', depicted, lambda s: s['entry'].undo_depict(*s['items'])),
+            ('on_selection_changed', selected, lambda s: s['entry'].on_selection_changed()),
+        )
+        for name, setup, fn in cases:
+            results.append(dict(measure(setup, fn, r), operation=name, atoms=n, selected=len(atoms)))
+    return {'benchmark': 'chimera', 'backend': 'faketk+fakechimera',
+            'python': platform.python_version(), 'timestamp': time.time(), 'results': results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='10000,100000,1000000')
+    parser.add_argument('--fraction', type=float, default=0.01)
+    parser.add_argument('--models', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=None)
+    parser.add_argument('-o', '--output', default=None)
+    args = parser.parse_args()
+    report = run([int(n) for n in args.sizes.split(',')], args.fraction, args.repeat, args.models)
+    dump = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(dump)
+    else:
+        print(dump)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Memory footprint of SelectionItem storage: the compact __slots__ layout
+versus the former per-instance __dict__ layout.
+
+    python benchmarks/bench_item_memory.py [N ...]
+
+Prints one JSON document with bytes per item for each layout.
+"""
+
+from __future__ import print_function, division
+import gc
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from selectionwidget.model import SelectionItem
+
+
+class DictItem(SelectionItem):
+
+    """ Same item, but with a __dict__ as every instance had before """
+
+
+def footprint(item):
+    size = sys.getsizeof(item)
+    if hasattr(item, '__dict__'):
+        size += sys.getsizeof(item.__dict__)
+    return size
+
+
+def measure(cls, n):
+    gc.collect()
+    t0 = time.time()
+    items = [cls(text='#0:{}.A@CA'.format(i), obj=i, parent=None, validator=None) for i in range(n)]
+    elapsed = time.time() - t0
+    # Text and obj are shared by both layouts, only count the containers
+    return {'bytes_per_item': sum(footprint(item) for item in items) / n,
+            'create_seconds': elapsed}
+
+
+def main(sizes):
+    results = []
+    for n in sizes:
+        row = {'n': n}
+        for name, cls in (('slots', SelectionItem), ('dict', DictItem)):
+            row[name] = measure(cls, n)
+        row['ratio'] = row['dict']['bytes_per_item'] / row['slots']['bytes_per_item']
+        results.append(row)
+    print(json.dumps({'benchmark': 'item_memory', 'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main([int(n) for n in sys.argv[1:]] or [1000, 50000])
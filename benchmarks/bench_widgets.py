@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Microbenchmarks of the hot paths of `selectionwidget.widgets`, run on
+the stub Tk backend in `faketk` so they work on headless boxes.
+
+    python benchmarks/bench_widgets.py [--sizes 10,100,1000,10000] [--repeat N] [-o results.json]
+
+Emits a JSON document with min/median latencies (ms) and Tcl call
+counts for each operation and token count.
+"""
+
+from __future__ import print_function, division
+import argparse
+import json
+import os
+import platform
+import re
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [HERE, os.path.join(HERE, '..')]
+import faketk
+faketk.install()
+from selectionwidget.widgets import SelectionEntry
+
+_VALID = re.compile(r'^#\d+:\d+\.[A-Z]@\w+$')
+
+
+def validator(text):
+    return text if _VALID.match(text) else None
+
+
+def spec(i):
+    return '#0:{}.A@CA'.format(i)
+
+
+def make_entry(n, itemize=True):
+    entry = SelectionEntry(validator=validator, chunk_threshold=float('inf'))
+    entry.insert('end', ' '.join(spec(i) for i in range(n)))
+    if itemize:
+        entry.itemize()
+    return entry
+
+
+def measure(setup, run, repeat):
+    """
+    Call `run(state)` on a fresh `setup()` state `repeat` times.
+    """
+    times, calls = [], []
+    for _ in range(repeat):
+        state = setup()
+        entry = state[0] if isinstance(state, tuple) else state
+        entry.tcl_calls = 0
+        t0 = time.time()
+        run(state)
+        times.append((time.time() - t0) * 1000)
+        calls.append(entry.tcl_calls)
+    times.sort()
+    return {'min_ms': times[0], 'median_ms': times[len(times) // 2],
+            'tcl_calls': max(calls), 'repeat': repeat}
+
+
+# Operations
+def op_itemize(n, repeat):
+    return measure(lambda: make_entry(n, itemize=False), lambda e: e.itemize(), repeat)
+
+
+def op_highlight_all_text(n, repeat):
+    def setup():
+        entry = make_entry(n)
+        entry.invalidate_highlight()
+        return entry
+    return measure(setup, lambda e: e.highlight_all_text(), repeat)
+
+
+def op_highlight_unchanged(n, repeat):
+    return measure(lambda: make_entry(n), lambda e: e.highlight_all_text(), repeat)
+
+
+def op_rebuild_tags(n, repeat):
+    def setup():
+        entry = make_entry(n)
+        entry.items[0].delete()  # shifts every palette colour
+        return entry
+    return measure(setup, lambda e: e.rebuild_tags(), repeat)
+
+
+def op_clear_items(n, repeat):
+    return measure(lambda: make_entry(n), lambda e: e.clear_items(), repeat)
+
+
+def op_item_delete(n, repeat):
+    return measure(lambda: make_entry(n), lambda e: e.items[len(e.items) // 2].delete(), repeat)
+
+
+# Keystroke to callback
+class _KeyEvent(object):
+    keysym = 'a'
+
+
+def _keystroke(edit):
+    def setup(n):
+        entry = make_entry(n)
+        fired = []
+        entry.add_change_callback(fired.append)
+        return entry, fired
+
+    def run(state):
+        entry, fired = state
+        edit(entry)
+        entry.on_key_release(_KeyEvent)
+        entry.flush()
+        assert fired, 'no change callback fired'
+    return setup, run
+
+
+def _type_at_end(entry):
+    entry.insert('end-1c', '0')
+
+
+def _type_in_middle(entry):
+    item = entry.items[len(entry.items) // 2]
+    entry.insert(entry.text_index(item.end), '0')
+
+
+def _delete_token(entry):
+    item = entry.items[len(entry.items) // 2]
+    entry.delete(entry.text_index(item.start), entry.text_index(item.end + len(item.sep)))
+
+
+def _paste_100(entry):
+    entry.insert('end-1c', ' ' + ' '.join(spec(i) for i in range(10 ** 6, 10 ** 6 + 100)))
+
+
+KEYSTROKES = (('type_at_end', _type_at_end), ('type_in_middle', _type_in_middle),
+              ('delete_token', _delete_token), ('paste_100_tokens', _paste_100))
+
+OPERATIONS = (('itemize', op_itemize), ('highlight_all_text', op_highlight_all_text),
+              ('highlight_all_text_unchanged', op_highlight_unchanged),
+              ('rebuild_tags', op_rebuild_tags), ('clear_items', op_clear_items),
+              ('item_delete', op_item_delete))
+
+
+def run(sizes, repeat=None):
+    results = []
+    for n in sizes:
+        r = repeat or max(3, min(25, 5000 // n))
+        for name, op in OPERATIONS:
+            results.append(dict(op(n, r), operation=name, tokens=n))
+        for name, edit in KEYSTROKES:
+            setup, fn = _keystroke(edit)
+            results.append(dict(measure(lambda: setup(n), fn, r), operation='keystroke:' + name, tokens=n))
+    return {'benchmark': 'widgets', 'backend': 'faketk',
+            'python': platform.python_version(), 'timestamp': time.time(), 'results': results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='10,100,1000,10000')
+    parser.add_argument('--repeat', type=int, default=None)
+    parser.add_argument('-o', '--output', default=None)
+    args = parser.parse_args()
+    report = run([int(n) for n in args.sizes.split(',')], args.repeat)
+    dump = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(dump)
+    else:
+        print(dump)
+
+
+if __name__ == '__main__':
+    main()
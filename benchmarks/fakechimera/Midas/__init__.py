@@ -0,0 +1,7 @@
+# encoding: utf-8
+
+_focused = []
+
+
+def focus(spec):
+    _focused.append(spec)
@@ -0,0 +1,236 @@
+# encoding: utf-8
+
+"""
+Synthetic stand-in for the parts of UCSF Chimera used by
+`selectionwidget.gui`, for benchmarking outside a Chimera install.
+
+Only plain Python objects live here: molecules are generated with
+`chimera.synthetic`, specs are evaluated by `chimera.specifier` with a
+naive tree walk, and triggers fire synchronously when activated.
+"""
+
+from __future__ import print_function, division
+
+nogui = True
+
+
+class MaterialColor(object):
+
+    __slots__ = ('name', 'rgba', 'opacity')
+    _named = {'white': (1.0, 1.0, 1.0), 'blue': (0.0, 0.0, 1.0), 'red': (1.0, 0.0, 0.0),
+              'purple': (0.63, 0.13, 0.94), 'sienna': (0.63, 0.32, 0.18), 'grey': (0.44, 0.5, 0.56),
+              'green': (0.0, 1.0, 0.0), 'turquoise': (0.25, 0.88, 0.82), 'gold': (1.0, 0.84, 0.0),
+              'tan': (0.82, 0.71, 0.55)}
+
+    def __init__(self, r=1.0, g=1.0, b=1.0, a=1.0, name=None):
+        self.name = name
+        self.rgba = (r, g, b)
+        self.opacity = a
+
+    @classmethod
+    def lookup(cls, name):
+        return cls(*cls._named.get(name, (1.0, 1.0, 1.0)), name=name)
+
+    def rgba_(self):
+        return self.rgba + (self.opacity,)
+
+
+class MolResId(object):
+
+    __slots__ = ('position', 'chainId')
+
+    def __init__(self, position, chainId):
+        self.position = position
+        self.chainId = chainId
+
+
+class Point(object):
+
+    __slots__ = ('x', 'y', 'z')
+
+    def __init__(self, x=0.0, y=0.0, z=0.0):
+        self.x, self.y, self.z = x, y, z
+
+    def __getitem__(self, i):
+        return (self.x, self.y, self.z)[i]
+
+
+class Xform(object):
+
+    """
+    Identity transform: synthetic models are never moved.
+    """
+
+    def inverse(self):
+        return self
+
+    def apply(self, point):
+        return point
+
+
+class OpenState(object):
+
+    def __init__(self):
+        self.xform = Xform()
+
+
+class Atom(object):
+
+    __slots__ = ('name', 'molecule', 'residue', 'color', 'display', '_coord', 'coordIndex',
+                 '__dict__', '__weakref__')
+
+    def __init__(self, name, residue, coord, index):
+        self.name = name
+        self.residue = residue
+        self.molecule = residue.molecule
+        self.color = None
+        self.display = True
+        self._coord = coord
+        self.coordIndex = index
+
+    def coord(self):
+        return Point(*self._coord)
+
+    def xformCoord(self):
+        return self.coord()
+
+    def __repr__(self):
+        return '<Atom #{}:{}.{}@{}>'.format(self.molecule.id, self.residue.id.position,
+                                            self.residue.id.chainId, self.name)
+
+
+class Bond(object):
+
+    __slots__ = ('atoms', '__dict__')
+
+    def __init__(self, a1, a2):
+        self.atoms = (a1, a2)
+
+
+class Residue(object):
+
+    __slots__ = ('id', 'type', 'molecule', 'atoms', 'ribbonColor', 'fillColor',
+                 '__dict__', '__weakref__')
+
+    def __init__(self, molecule, position, chainId, type='ALA'):
+        self.molecule = molecule
+        self.id = MolResId(position, chainId)
+        self.type = type
+        self.atoms = []
+        self.ribbonColor = None
+        self.fillColor = None
+
+    @property
+    def atomsMap(self):
+        return dict((a.name, [a]) for a in self.atoms)
+
+    def __repr__(self):
+        return '<Residue #{}:{}.{}>'.format(self.molecule.id, self.id.position, self.id.chainId)
+
+
+class Model(object):
+
+    def __init__(self, id=0, subid=0, name='model'):
+        self.id = id
+        self.subid = subid
+        self.name = name
+        self.display = True
+        self.openState = OpenState()
+
+    @property
+    def molecule(self):
+        return self
+
+
+class Molecule(Model):
+
+    def __init__(self, id=0, subid=0, name='molecule'):
+        Model.__init__(self, id, subid, name)
+        self.atoms = []
+        self.residues = []
+        self.bonds = []
+        self.color = None
+
+    def __repr__(self):
+        return '<Molecule #{}>'.format(self.id)
+
+
+class _Changes(object):
+
+    def __init__(self, created=(), modified=(), deleted=(), reasons=()):
+        self.created = set(created)
+        self.modified = set(modified)
+        self.deleted = set(deleted)
+        self.reasons = set(reasons)
+
+
+class TriggerSet(object):
+
+    def __init__(self):
+        self._handlers = {}
+        self._ids = 0
+
+    def addHandler(self, name, func, data):
+        self._ids += 1
+        self._handlers.setdefault(name, {})[self._ids] = func, data
+        return self._ids
+
+    def deleteHandler(self, name, handler):
+        self._handlers.get(name, {}).pop(handler, None)
+
+    def activateTrigger(self, name, triggerData=None):
+        for key, (func, data) in sorted(self._handlers.get(name, {}).items()):
+            func(name, data, triggerData)
+
+
+class OpenModels(object):
+
+    def __init__(self):
+        self._models = []
+
+    def list(self, modelTypes=None, id=None):
+        models = self._models
+        if modelTypes:
+            models = [m for m in models if isinstance(m, tuple(modelTypes))]
+        if id is not None:
+            models = [m for m in models if m.id == id]
+        return list(models)
+
+    def add(self, models):
+        self._models.extend(models)
+        triggers.activateTrigger('Model', _Changes(created=models))
+        triggers.activateTrigger('file open', None)
+
+    def close(self, models):
+        models = set(models)
+        self._models = [m for m in self._models if m not in models]
+        triggers.activateTrigger('Model', _Changes(deleted=models))
+
+    def reset(self):
+        self._models = []
+
+
+class Camera(object):
+
+    def __init__(self):
+        self.center = (0.0, 0.0, 0.0)
+
+
+class Viewer(object):
+
+    def __init__(self):
+        self.background = None
+        self.camera = Camera()
+        self.viewSize = 1.0
+
+
+def runCommand(command):
+    _commands.append(command)
+
+
+_commands = []
+triggers = TriggerSet()
+openModels = OpenModels()
+viewer = Viewer()
+
+from . import extension, selection, specifier, colorTable, baseDialog  # noqa
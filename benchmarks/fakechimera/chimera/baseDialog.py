@@ -0,0 +1,7 @@
+# encoding: utf-8
+
+
+class ModelessDialog(object):
+
+    def __init__(self, *args, **kwargs):
+        pass
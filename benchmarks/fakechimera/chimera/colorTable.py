@@ -0,0 +1,13 @@
+# encoding: utf-8
+
+from . import MaterialColor
+
+_colors = {}
+
+
+def getColorByName(name):
+    try:
+        return _colors[name]
+    except KeyError:
+        color = _colors[name] = MaterialColor.lookup(name)
+        return color
@@ -0,0 +1,22 @@
+# encoding: utf-8
+
+
+class _Manager(object):
+
+    def registerInstance(self, instance):
+        pass
+
+    def deregisterInstance(self, instance):
+        pass
+
+    def registerExtension(self, extension):
+        pass
+
+
+class EMO(object):
+
+    def __init__(self, path=None):
+        self.path = path
+
+
+manager = _Manager()
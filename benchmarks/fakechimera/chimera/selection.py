@@ -0,0 +1,58 @@
+# encoding: utf-8
+
+"""
+Current selection, kept as an ordered set of atoms.
+"""
+
+from collections import OrderedDict
+
+_current = OrderedDict()
+
+
+def _atoms(objects):
+    for obj in objects:
+        atoms = getattr(obj, 'atoms', None)
+        if atoms is None:
+            yield obj
+        else:
+            for a in atoms:
+                yield a
+
+
+def addCurrent(objects):
+    for a in _atoms(objects):
+        _current[a] = None
+
+
+def removeCurrent(objects):
+    for a in _atoms(objects):
+        _current.pop(a, None)
+
+
+def clearCurrent():
+    _current.clear()
+
+
+def setCurrent(objects):
+    clearCurrent()
+    addCurrent(objects)
+
+
+def currentAtoms():
+    return list(_current)
+
+
+def currentResidues():
+    return list(OrderedDict.fromkeys(a.residue for a in _current))
+
+
+def currentMolecules():
+    return list(OrderedDict.fromkeys(a.molecule for a in _current))
+
+
+def currentChains():
+    return list(OrderedDict.fromkeys((a.molecule, a.residue.id.chainId) for a in _current))
+
+
+def currentBonds():
+    return []
@@ -0,0 +1,60 @@
+# encoding: utf-8
+
+"""
+Naive evaluator for `#model:position.chain@name` specs (every part is
+optional), plus `sel` for the current selection. Like Chimera's generic
+machinery, it walks every open molecule for each spec.
+"""
+
+import re
+from collections import OrderedDict
+
+_SPEC = re.compile(r'^(?:#(\d+))?(?::(\d+)(?:\.(\w*))?)?(?:@(\w+))?$')
+
+
+class Selection(object):
+
+    def __init__(self, atoms):
+        self._atoms = atoms
+
+    def __len__(self):
+        return len(self._atoms)
+
+    def atoms(self):
+        return list(self._atoms)
+
+    def residues(self):
+        return list(OrderedDict.fromkeys(a.residue for a in self._atoms))
+
+    def molecules(self):
+        return list(OrderedDict.fromkeys(a.molecule for a in self._atoms))
+
+    def chains(self):
+        return list(OrderedDict.fromkeys((a.molecule, a.residue.id.chainId) for a in self._atoms))
+
+    def bonds(self):
+        return []
+
+
+def evalSpec(spec, models=None):
+    import chimera
+    spec = spec.strip()
+    if spec == 'sel':
+        return Selection(chimera.selection.currentAtoms())
+    match = _SPEC.match(spec)
+    if match is None or not spec:
+        raise SyntaxError('invalid atom spec: {!r}'.format(spec))
+    model, position, chain, name = match.groups()
+    atoms = []
+    if models is None:
+        models = chimera.openModels.list(modelTypes=[chimera.Molecule])
+    for mol in models:
+        if model is not None and mol.id != int(model):
+            continue
+        for res in mol.residues:
+            if position is not None and res.id.position != int(position):
+                continue
+            if chain is not None and res.id.chainId.strip() != chain:
+                continue
+            atoms.extend(a for a in res.atoms if name is None or a.name == name)
+    return Selection(atoms)
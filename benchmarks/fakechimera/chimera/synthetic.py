@@ -0,0 +1,51 @@
+# encoding: utf-8
+
+"""
+Synthetic molecule generator.
+"""
+
+from __future__ import division
+import random
+import string
+from . import Molecule, Residue, Atom, MaterialColor
+
+ATOM_NAMES = ('N', 'CA', 'C', 'O', 'CB', 'CG', 'CD', 'CE', 'NZ', 'OG', 'SD', 'OH')
+
+
+def build_molecule(id=0, chains=1, residues=100, atoms=10, seed=None):
+    """
+    Build a Molecule with `chains` chains of `residues` residues of
+    `atoms` atoms each, laid out on a jittered helix-free grid.
+    """
+    rng = random.Random(seed if seed is not None else id)
+    colors = [MaterialColor.lookup(name) for name in ('tan', 'blue', 'red', 'white')]
+    mol = Molecule(id=id, name='synthetic_{}'.format(id))
+    mol.color = colors[0]
+    index = 0
+    for c in range(chains):
+        chain_id = string.ascii_uppercase[c % 26]
+        for pos in range(1, residues + 1):
+            res = Residue(mol, pos, chain_id)
+            res.ribbonColor = colors[1]
+            res.fillColor = colors[2]
+            base = (c * 30.0, (pos % 20) * 3.8, (pos // 20) * 3.8)
+            for k in range(atoms):
+                coord = tuple(b + rng.uniform(-1.5, 1.5) for b in base)
+                atom = Atom(ATOM_NAMES[k % len(ATOM_NAMES)] + ('' if k < len(ATOM_NAMES) else str(k)),
+                            res, coord, index)
+                atom.color = colors[k % 4]
+                res.atoms.append(atom)
+                mol.atoms.append(atom)
+                index += 1
+            mol.residues.append(res)
+    return mol
+
+
+def build_system(n_atoms, models=1, chains=4, atoms_per_residue=10):
+    """
+    Molecules totalling about `n_atoms` atoms.
+    """
+    per_model = max(1, n_atoms // models)
+    residues = max(1, per_model // (chains * atoms_per_residue))
+    return [build_molecule(id=m, chains=chains, residues=residues, atoms=atoms_per_residue)
+            for m in range(models)]
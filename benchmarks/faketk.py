@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+A stub of the small `Tkinter.Text` surface used by `SelectionEntry`, so
+the widget layer can be benchmarked on headless boxes without Xvfb.
+
+Call `install()` before importing `selectionwidget.widgets`. Every call
+that would cross the Python/Tcl boundary is counted in `Text.tcl_calls`.
+"""
+
+from __future__ import print_function, division
+import re
+import sys
+import types
+
+_INDEX = re.compile(r'^(?:(\d+)\.(\d+)|(end|[A-Za-z_]\w*))((?:[+-]\d+c)*)$')
+_OFFSET = re.compile(r'([+-]\d+)c')
+
+
+class Text(object):
+
+    def __init__(self, parent=None, **kwargs):
+        self.buffer = ''
+        self.marks = {'insert': 0}
+        self.tags = {'sel': []}
+        self.tcl_calls = 0
+        self.tk = self
+        self._w = '.fake_text'
+        self._jobs = {}
+        self._job_ids = 0
+
+    # Indices
+    def _offset(self, index):
+        index = str(index)
+        if index.startswith('1.0+') and index.endswith('c') and index[4:-1].isdigit():
+            return min(int(index[4:-1]), len(self.buffer))
+        match = _INDEX.match(str(index).replace(' ', ''))
+        if match is None:
+            raise ValueError('bad text index "{}"'.format(index))
+        line, col, name, modifiers = match.groups()
+        if name == 'end':
+            pos = len(self.buffer) + 1
+        elif name is not None:
+            pos = self.marks[name]
+        else:
+            pos = -1
+            for _ in range(int(line) - 1):
+                pos = self.buffer.find('\n', pos + 1)
+                if pos < 0:
+                    pos = len(self.buffer)
+                    break
+            pos += 1 + int(col)
+        for delta in _OFFSET.findall(modifiers):
+            pos += int(delta)
+        return max(0, min(pos, len(self.buffer)))
+
+    def index(self, index):
+        self.tcl_calls += 1
+        return '1.{}'.format(self._offset(index))
+
+    # Configuration
+    def configure(self, **kwargs):
+        self.tcl_calls += 1
+
+    config = configure
+
+    def bind(self, sequence, func=None, add=None):
+        self.tcl_calls += 1
+
+    def destroy(self):
+        self._jobs.clear()
+
+    # Contents
+    def get(self, start, end=None):
+        self.tcl_calls += 1
+        i = self._offset(start)
+        return self.buffer[i:self._offset(end)] if end is not None else self.buffer[i:i + 1]
+
+    def insert(self, index, chars, *args):
+        self.tcl_calls += 1
+        i = self._offset(index)
+        self.buffer = self.buffer[:i] + chars + self.buffer[i:]
+        self._shift(i, len(chars))
+        self.marks['insert'] = i + len(chars)
+
+    def delete(self, start, end=None):
+        self.tcl_calls += 1
+        i = self._offset(start)
+        j = self._offset(end) if end is not None else i + 1
+        if j <= i:
+            return
+        self.buffer = self.buffer[:i] + self.buffer[j:]
+        self._shift(j, i - j)
+
+    def _shift(self, at, delta):
+        for name, pos in self.marks.items():
+            if pos >= at:
+                self.marks[name] = max(at if delta < 0 else 0, pos + delta)
+        for name, ranges in self.tags.items():
+            self.tags[name] = [(a + delta if a >= at else a, b + delta if b >= at else b)
+                               for (a, b) in ranges if not (delta < 0 and at + delta <= a and b <= at)]
+
+    def search(self, pattern, index, stopindex=None, **kwargs):
+        self.tcl_calls += 1
+        found = self.buffer.find(pattern, self._offset(index))
+        return '' if found < 0 else '1.{}'.format(found)
+
+    def mark_set(self, name, index):
+        self.tcl_calls += 1
+        self.marks[name] = self._offset(index)
+
+    # Tags
+    def tag_config(self, name, **kwargs):
+        self.tcl_calls += 1
+        self.tags.setdefault(name, [])
+
+    tag_configure = tag_config
+
+    def tag_names(self, index=None):
+        self.tcl_calls += 1
+        return tuple(self.tags)
+
+    def tag_add(self, name, *indices):
+        self.tcl_calls += 1
+        ranges = self.tags.setdefault(name, [])
+        for a, b in zip(indices[::2], indices[1::2]):
+            ranges.append((self._offset(a), self._offset(b)))
+
+    def tag_remove(self, name, *indices):
+        self.tcl_calls += 1
+        if len(indices) == 1:
+            indices = (indices[0], '{}+1c'.format(indices[0]))
+        ranges = self.tags.setdefault(name, [])
+        for a, b in zip(indices[::2], indices[1::2]):
+            a, b = self._offset(a), self._offset(b)
+            ranges[:] = [(s, e) for (s, e) in ranges if e <= a or s >= b]
+
+    def tag_ranges(self, name):
+        self.tcl_calls += 1
+        return tuple('1.{}'.format(i) for pair in sorted(self.tags.get(name, ())) for i in pair)
+
+    # Tcl passthrough, as in `widget.tk.call(widget._w, ...)`
+    def call(self, widget, command, subcommand, *args):
+        self.tcl_calls -= 1  # counted by the delegate
+        return getattr(self, '{}_{}'.format(command, subcommand))(*args)
+
+    # Event loop
+    def after(self, ms, func=None, *args):
+        self._job_ids += 1
+        self._jobs[self._job_ids] = func, args
+        return self._job_ids
+
+    def after_idle(self, func, *args):
+        return self.after(0, func, *args)
+
+    def after_cancel(self, job):
+        self._jobs.pop(job, None)
+
+    def run_pending(self):
+        """
+        Run every scheduled `after` job, including those scheduled meanwhile.
+        """
+        while self._jobs:
+            job = min(self._jobs)
+            func, args = self._jobs.pop(job)
+            func(*args)
+
+
+class Widget(object):
+
+    def __init__(self, parent=None, **kwargs):
+        pass
+
+    def configure(self, **kwargs):
+        pass
+
+    config = configure
+
+    def pack(self, **kwargs):
+        pass
+
+
+class Frame(Widget):
+    pass
+
+
+class Label(Widget):
+    pass
+
+
+class Button(Widget):
+    pass
+
+
+class Tk(Widget):
+
+    def withdraw(self):
+        pass
+
+
+def install():
+    """
+    Register this stub as the `Tkinter` module, if the real one was not
+    imported yet.
+    """
+    if 'Tkinter' in sys.modules and not getattr(sys.modules['Tkinter'], '_fake', False):
+        return sys.modules['Tkinter']
+    module = types.ModuleType('Tkinter')
+    module.Text, module.Tk, module._fake = Text, Tk, True
+    module.Frame, module.Label, module.Button = Frame, Label, Button
+    sys.modules['Tkinter'] = module
+    return module
@@ -4,18 +4,22 @@
 
 from __future__ import print_function, division 
 # Python stdlib
+import re
 import Tkinter as tk
+from array import array
+from collections import OrderedDict, Counter
 from contextlib import contextmanager
+from itertools import izip
 # Chimera stuff
 import chimera
 from chimera.baseDialog import ModelessDialog
-from chimera.specifier import evalSpec
 from chimera.selection import (clearCurrent as clear_selection, addCurrent as add_to_current_selection,
-                               removeCurrent as remove_from_current_selection)
+                               removeCurrent as remove_from_current_selection,
+                               currentAtoms as selected_atoms)
 from chimera.colorTable import getColorByName as chimera_color
-from Midas import focus
 # Own
-from .widgets import SelectionItem, SelectionEntry
+from .widgets import SelectionEntry
+from .specs import ChimeraSelectionModel, ChimeraItem
 
 """
 An Excel-like selection dialog for UCSF Chimera
@@ -86,14 +90,26 @@ class SelectionDialog(ModelessDialog):
         self.canvas.pack(expand=True, fill='x')
         self.entry = ChimeraSelectionEntry(self.canvas, mode=self.mode, respond_to_focus=False, width=50)
         self.entry.pack(padx=10, pady=10, expand=True, fill='x')
+        self.entry.add_progress_callback(self.on_progress)
         self.entry.desaturate()
+        self.progress = tk.Label(self.canvas, anchor='w', foreground='#606060')
+        self.progress.pack(padx=10, expand=True, fill='x')
+
+    def on_progress(self, done, total):
+        if done < total:
+            self.progress.configure(text='Validating {}/{} specs...'.format(done, total))
+        else:
+            self.progress.configure(text='')
 
     def OK(self):
+        self.entry.flush()
         self.Close()
 
     def Close(self):
+        self.entry.cancel_itemize()
         chimera.viewer.background = None
         self.entry.resaturate()
+        self.entry.specifiers.clear()
         for (trigger, key), handler in self.entry._handlers.items():
             chimera.triggers.deleteHandler(trigger, handler)
         global ui
@@ -106,110 +122,270 @@ class SelectionDialog(ModelessDialog):
 # Custom widgets
 class ChimeraSelectionEntry(SelectionEntry):
     
-    allowed_modes = ('atoms', 'bonds', 'residues', 'chains', 'molecules')
+    allowed_modes = ChimeraSelectionModel.allowed_modes
+    MODEL_OPTIONS = ('validator', 'splitter', 'item_creator', 'cache_size', 'resolver',
+                     'chunk_threshold', 'batch_validator')
     white = chimera.MaterialColor.lookup('white')
     white.opacity = 0.5
-
-    def __init__(self, parent=None, mode='atoms', respond_to_focus=True, **kwargs):
-        if mode not in self.allowed_modes:
-            raise ValueError('mode must be one of {}'.format(self.allowed_modes))
-        self.mode = mode
-
-        SelectionEntry.__init__(self, validator=self.validate, parent=parent, **kwargs)
-        self.item_creator = ChimeraItem
+    # Residues within this many angstroms of the selection are kept in view when focusing
+    FOCUS_ZONE = 3.0
+    # Trigger reasons that can change formatted specifiers; colour, display
+    # or ribbon changes (e.g. our own desaturation) leave them alone
+    RENUMBERED = re.compile(r'\b(?:id|subid|chain\w*|position|renumber\w*)\b', re.IGNORECASE)
+
+    def __init__(self, parent=None, mode='atoms', respond_to_focus=True, model=None, **kwargs):
+        if model is None:
+            options = dict((key, kwargs.pop(key)) for key in self.MODEL_OPTIONS if key in kwargs)
+            model = ChimeraSelectionModel(mode=mode, **options)
+        SelectionEntry.__init__(self, parent=parent, model=model, **kwargs)
+        self._old_selection = set()
         self.on_selection_changed()
 
         # Private vars
-        self._old_selection = self.current_selection()
         self._old_background = chimera.viewer.background
-        self._colored_molecules = []
+        self._snapshots = OrderedDict()
+        self._color_table = ColorTable()
         self._handlers = {}
-        self._depicted = []
+        self._depicted = set()
+        self._desaturated = False
+        self._materials = {}
         self._selecting = False
+        self._focus_job = None
+        self._focus_state = ()
 
         # Triggers
-        self._handlers[('file open', self.desaturate)] =  chimera.triggers.addHandler('file open', self.desaturate, None)
-        self._handlers[('file open', self.itemize)] =  chimera.triggers.addHandler('file open', self.itemize, None)
+        self._handlers[('file open', self.on_file_open)] =  chimera.triggers.addHandler('file open', self.on_file_open, None)
+        self._handlers[('Model', self.on_models_changed)] =  chimera.triggers.addHandler('Model', self.on_models_changed, None)
+        self._handlers[('Atom', self.on_atoms_changed)] =  chimera.triggers.addHandler('Atom', self.on_atoms_changed, None)
+        self._handlers[('Residue', self.on_residues_changed)] =  chimera.triggers.addHandler('Residue', self.on_residues_changed, None)
+        self._handlers[('CoordSet', self.on_coordinates_changed)] =  chimera.triggers.addHandler('CoordSet', self.on_coordinates_changed, None)
         self._handlers[('selection changed', self.on_selection_changed_proxy)] =  chimera.triggers.addHandler('selection changed', self.on_selection_changed_proxy, None)
         if respond_to_focus:
             self.bind('<FocusIn>', self.on_focus_in)
             self.bind('<FocusOut>', self.on_focus_out)
-        self.add_callback(self.depict)
-        self.add_clear_callback(self.undo_depict)
+        self.add_change_callback(self.on_items_changed)
+
+    # Model delegation
+    @property
+    def mode(self):
+        return self.model.mode
+
+    @property
+    def spec_index(self):
+        return self.model.spec_index
+
+    @property
+    def spatial(self):
+        return self.model.spatial
+
+    @property
+    def specifiers(self):
+        return self.model.specifiers
 
-    # Methods
     def validate(self, query):
-        try:
-            sel = evalSpec(query)
-            if sel:
-                current = getattr(sel, self.mode)()
-                if len(current) == 1:
-                    return current[0]
-        except:  # Syntax error, etc
-            return
+        return self.model.validate(query)
+
+    def validate_batch(self, queries):
+        return self.model.validate_batch(queries)
+
+    def rebuild_spec_index(self, *args):
+        self.model.rebuild_spec_index()
 
+    # Methods
     def current_selection(self):
         return getattr(chimera.selection, 'current' + self.mode.title())()
 
+    def item_atoms(self, item):
+        return [item.obj] if self.mode == 'atoms' else item.obj.atoms
+
     def focus_atoms(self):
-        selected = self.current_selection()
-        if selected:
-            focus('sel zr < 3')
-        else:
-            chimera.runCommand('focus')
+        """
+        Focus the camera on the selection once the current burst of
+        changes is over, coalescing all requests until then.
+        """
+        if self._focus_job is None:
+            self._focus_job = self.after_idle(self.refocus)
+
+    def cancel_focus(self):
+        if self._focus_job is not None:
+            self.after_cancel(self._focus_job)
+        self._focus_job = None
+
+    def refocus(self):
+        self._focus_job = None
+        with self.timed('focus'):
+            atoms = selected_atoms()
+            bbox = self.bbox(atoms)
+            # Skip only if neither the selection nor the camera moved since last time
+            if (bbox, self.camera_state()) == self._focus_state:
+                return
+            if bbox is None:
+                chimera.runCommand('focus')
+            else:
+                # Same target as `focus sel zr < 3`, without the spec machinery
+                lower, upper = self.bbox(self.spatial.zone(atoms, self.FOCUS_ZONE, residues=True))
+                viewer = chimera.viewer
+                viewer.camera.center = tuple((lo + up) / 2 for (lo, up) in zip(lower, upper))
+                viewer.viewSize = max(up - lo for (lo, up) in zip(lower, upper)) / 2
+            self._focus_state = bbox, self.camera_state()
+
+    @staticmethod
+    def camera_state():
+        viewer = chimera.viewer
+        return tuple(viewer.camera.center), viewer.viewSize
+
+    @staticmethod
+    def bbox(atoms):
+        """
+        Corners of the box enclosing `atoms`, in scene coordinates, or
+        None if there are none.
+        """
+        if not atoms:
+            return
+        coords = [a.xformCoord() for a in atoms]
+        xs, ys, zs = [c.x for c in coords], [c.y for c in coords], [c.z for c in coords]
+        return (min(xs), min(ys), min(zs)), (max(xs), max(ys), max(zs))
+
+    def material_color(self, name):
+        color = self._materials.get(name)
+        if color is None:
+            color = self._materials[name] = chimera_color(name)
+        return color
+
+    @staticmethod
+    def paint(color, targets):
+        for target in targets:
+            target.color = color
+
+    def paint_groups(self, groups):
+        """
+        Recolor `groups`, a mapping of color names to the (objects, atoms)
+        that take that color. Residues and molecules are colored with one
+        Midas command per group; anything else, or any group that has no
+        exact compact spec, is painted atom by atom.
+        """
+        for name, (objs, atoms) in groups.items():
+            spec = self.group_spec(objs)
+            if spec is None:
+                self.paint(self.material_color(name), atoms)
+            else:
+                chimera.runCommand('color {},a {}'.format(name, spec))
+
+    @staticmethod
+    def group_spec(objs):
+        """
+        A Midas spec naming exactly the residues or molecules in `objs`,
+        with consecutive residue positions folded into ranges, or None if
+        there is no such spec (atoms, chains, models sharing an id, or
+        insertion codes only partially in the group).
+        """
+        if not objs:
+            return
+        molecules = chimera.openModels.list(modelTypes=[chimera.Molecule])
+        ids = Counter(m.id for m in molecules)
+        if all(isinstance(obj, chimera.Molecule) for obj in objs):
+            if any(ids[mol.id] > 1 for mol in objs):
+                return
+            return '#' + ','.join(str(i) for i in sorted(set(mol.id for mol in objs)))
+        if not all(isinstance(obj, chimera.Residue) for obj in objs):
+            return
+        by_molecule = {}
+        for r in set(objs):
+            by_molecule.setdefault(r.molecule, Counter())[(r.id.chainId.strip(), r.id.position)] += 1
+        specs = []
+        for mol, keys in sorted(by_molecule.items(), key=lambda pair: pair[0].id):
+            if ids[mol.id] > 1:
+                return
+            everything = Counter((r.id.chainId.strip(), r.id.position) for r in mol.residues)
+            if any(everything[key] != n for key, n in keys.items()):
+                return
+            chains = OrderedDict()
+            for chain, position in sorted(keys):
+                runs = chains.setdefault(chain, [])
+                if runs and position > 0 and runs[-1][1] == position - 1:
+                    runs[-1][1] = position
+                else:
+                    runs.append([position, position])
+            ranges = ['{}.{}'.format(first if first == last else '{}-{}'.format(first, last), chain)
+                      for chain, runs in chains.items() for first, last in runs]
+            specs.append('#{}:{}'.format(mol.id, ','.join(ranges)))
+        return ' | '.join(specs)
 
     def depict(self, *items):
-        for item in items:
-            if not item.ok:
-                continue
-            atoms = [item.obj] if self.mode == 'atoms' else item.obj.atoms
-            with self.untriggered_selection():
-                add_to_current_selection(atoms)
-            self._depicted.extend(atoms)
-            for a in atoms:
-                a.color = chimera_color(item.tag)
+        with self.timed('depict'):
+            groups = OrderedDict()
+            atoms = []
+            for item in items:
+                if not item.ok:
+                    continue
+                item_atoms = self.item_atoms(item)
+                objs, group_atoms = groups.setdefault(item.tag, ([], []))
+                objs.append(item.obj)
+                group_atoms.extend(item_atoms)
+                atoms.extend(item_atoms)
+            if atoms:
+                with self.untriggered_selection():
+                    add_to_current_selection(atoms)
+                self._depicted.update(atoms)
+                self.paint_groups(groups)
         self.focus_atoms()
 
     def undo_depict(self, *items):
+        with self.timed('undo_depict'):
+            self._undo_depict(*items)
+
+    def _undo_depict(self, *items):
         if items:
-            objs = [item.obj for item in items if item.ok]
-            self._depicted = [i for i in self._depicted if i in objs]
+            objs = [a for item in items if item.ok for a in self.item_atoms(item)]
+            self._depicted.difference_update(objs)
         else:
-            objs = self._depicted[:]
-            self._depicted = []
-        for a in objs:
-            a.color = self.white
+            objs = list(self._depicted)
+            self._depicted = set()
+        self.paint(self.white, objs)
         with self.untriggered_selection():
             remove_from_current_selection(objs)
          
     def desaturate(self, *args):
+        self._desaturated = True
         chimera.viewer.background = self.white
-        for mol in chimera.openModels.list(modelTypes=[chimera.Molecule]):
-            if mol in self._colored_molecules:
-                continue
-            mol._old_color = mol.color
-            mol.color = self.white
-            for a in mol.atoms:
-                if a not in self._depicted:
-                    a._old_color = a.color
-                    a.color = self.white
-            for r in mol.residues:
-                r._old_colors = r.ribbonColor, r.fillColor
-                r.color = self.white
-            self._colored_molecules.append(mol)
+        self.desaturate_models(chimera.openModels.list(modelTypes=[chimera.Molecule]))
+
+    def desaturate_models(self, molecules):
+        with self.timed('desaturate'):
+            for mol in molecules:
+                if mol in self._snapshots:
+                    continue
+                self._snapshots[mol] = ColorSnapshot(mol, self._color_table)
+                mol.color = self.white
+                self.paint(self.white, [a for a in mol.atoms if a not in self._depicted])
+                for r in mol.residues:
+                    r.ribbonColor = r.fillColor = self.white
+
+    def forget_models(self, molecules):
+        """
+        Drop all the state kept for closed `molecules`.
+        """
+        molecules = set(molecules)
+        for mol in molecules:
+            self._snapshots.pop(mol, None)
+        self.specifiers.forget(*molecules)
+        self.spatial.forget(*molecules)
+        self._depicted = set(a for a in self._depicted if a.molecule not in molecules)
 
     def resaturate(self):
-        chimera.viewer.background = self._old_background
-        for mol in chimera.openModels.list(modelTypes=[chimera.Molecule]):
-            mol.color = mol._old_color
-            del mol._old_color
-            for a in mol.atoms:
-                a.color = a._old_color
-                del a._old_color
-            for r in mol.residues:
-                r.ribbonColor, r.fillColor = r._old_colors
-                del r._old_colors
+        with self.timed('resaturate'):
+            self._desaturated = False
+            chimera.viewer.background = self._old_background
+            for snapshot in self._snapshots.values():
+                snapshot.restore()
+            self._snapshots.clear()
+            self._color_table.clear()
     
+    def destroy(self):
+        self.cancel_focus()
+        self.specifiers.clear()
+        SelectionEntry.destroy(self)
+
     # Event handlers
     def on_focus_in(self, event):
         self.desaturate()
@@ -217,30 +393,103 @@ class ChimeraSelectionEntry(SelectionEntry):
     def on_focus_out(self, event):
         self.resaturate()
 
+    def on_file_open(self, *args):
+        self.revalidate()
+
+    def on_models_changed(self, trigger, data, changes):
+        # Batched triggers (e.g. `close #0; open x.pdb`) carry both sets
+        deleted = set(changes.deleted)
+        created = [m for m in changes.created if isinstance(m, chimera.Molecule) and m not in deleted]
+        modified = []
+        if self.renumbered(changes):
+            modified = [m for m in changes.modified if isinstance(m, chimera.Molecule) and m not in deleted]
+        if modified:
+            # Renumbered models (`combine`, `changeid`) format new specifiers
+            self.specifiers.forget(*modified)
+            self.spec_index.add(*modified)
+        if deleted:
+            self.forget_models(deleted)
+            self.spec_index.remove(*deleted)
+        if created:
+            if self._desaturated:
+                self.desaturate_models(created)
+            self.spec_index.add(*created)
+        if deleted:
+            self.revalidate()
+        elif (created or modified) and self.cache is not None:
+            self.cache.invalidate()
+
+    def on_atoms_changed(self, trigger, data, changes):
+        if changes.created or changes.deleted:
+            self.stale_snapshots()
+        if changes.deleted:
+            # Deleted atoms cannot be traced back to their molecules: start
+            # over, which also covers any atoms created in the same batch
+            self.rebuild_spec_index()
+            self.spatial.clear()
+        elif changes.created:
+            molecules = set(a.molecule for a in changes.created)
+            self.spec_index.add(*molecules)
+            self.spatial.forget(*molecules)
+        if (changes.created or changes.deleted) and self.cache is not None:
+            self.cache.invalidate()
+
+    def on_residues_changed(self, trigger, data, changes):
+        if changes.created or changes.deleted:
+            self.stale_snapshots()
+        if changes.modified and self.renumbered(changes):
+            # Residues may have been renumbered or moved to another chain
+            molecules = set(r.molecule for r in changes.modified)
+            self.specifiers.forget(*molecules)
+            self.spec_index.add(*molecules)
+            if self.cache is not None:
+                self.cache.invalidate()
+
+    def renumbered(self, changes):
+        return any(self.RENUMBERED.search(reason) for reason in getattr(changes, 'reasons', ()))
+
+    def stale_snapshots(self):
+        for snapshot in self._snapshots.values():
+            snapshot.stale = True
+
+    def on_coordinates_changed(self, trigger, data, changes):
+        if changes.modified or changes.deleted:
+            self.spatial.clear()
+            # Zone tokens resolve differently once atoms move
+            if self.cache is not None:
+                self.cache.invalidate()
+
+    def on_items_changed(self, changes):
+        removed = [item for item in changes.removed if item.ok and item.obj not in self.objects]
+        if removed:
+            self.undo_depict(*removed)
+        if changes.added or changes.retagged:
+            self.depict(*(changes.added + changes.retagged))
+
     def on_selection_changed_proxy(self, *args):
         if not self._selecting:
             self.on_selection_changed(*args)
 
     def on_selection_changed(self, *args):
+        with self.timed_cycle('selection'):
+            self._on_selection_changed()
+
+    def _on_selection_changed(self):
         current = self.current_selection()
+        selected = set(current)
 
-        # Removed
-        for obj, items in self.objects.items():
-            if obj not in current:
-                self.undo_depict(*items)
-                for item in items:
-                    item.delete()
+        # Removed: entries whose object left the selection
+        removed = [item for obj, items in self.objects.items() if obj not in selected for item in items]
+        if removed:
+            self.delete_items(removed)
+            self.rebuild_tags()
 
-        self.rebuild_tags()
+        # Added: newly selected objects not in the entry yet, in selection order
+        added = [obj for obj in current if obj not in self._old_selection and obj not in self.objects]
+        if added:
+            self.add_items(added)
 
-        # Added
-        for obj in current:
-            if obj not in self._old_selection:
-                self.add_item(obj=obj, insert=True)
-        
-        
-        
-        self._old_selection = current       
+        self._old_selection = selected
 
     @contextmanager
     def untriggered_selection(self):
@@ -250,14 +499,83 @@ class ChimeraSelectionEntry(SelectionEntry):
 
 
 
-class ChimeraItem(SelectionItem):
+class ColorTable(object):
 
-    def specifier(self, obj):
-        if isinstance(obj, chimera.Atom):
-            return '#{}:{}.{}@{}'.format(obj.molecule.id, obj.residue.id.position, obj.residue.id.chainId.strip(), obj.name)
-        elif isinstance(obj, chimera.Molecule):
-            return '#{}'.format(obj.molecule)
-        elif isinstance(obj, chimera.Residue):
-            return '#{}:{}.{}'.format(obj.molecule.id, obj.id.position, obj.id.chainId)
-        elif isinstance(obj, chimera.Bond):
-            pass
\ No newline at end of file
+    """
+    Interns colors so snapshots can store small integers instead of
+    references to the color objects.
+    """
+
+    def __init__(self):
+        self.colors = []
+        self._index = {}
+
+    def intern(self, color):
+        try:
+            return self._index[color]
+        except KeyError:
+            i = self._index[color] = len(self.colors)
+            self.colors.append(color)
+            return i
+
+    def clear(self):
+        del self.colors[:]
+        self._index.clear()
+
+
+class ColorSnapshot(object):
+
+    """
+    Original colors of a molecule, its atoms and its residues, kept as
+    arrays of `ColorTable` indices in atom and residue order. Atoms are
+    restored from the molecule's current sequences, not from references.
+
+    Once atoms or residues are created or deleted the order no longer
+    holds, so a `stale` snapshot rebuilds the positions from the recorded
+    keys (atom coordinate indices; residues use their first atom's),
+    leaving new objects alone.
+    """
+
+    __slots__ = ('molecule', 'table', 'color', 'atom_keys', 'residue_keys',
+                 'atom_colors', 'ribbons', 'fills', 'stale')
+
+    def __init__(self, molecule, table):
+        intern = table.intern
+        atoms, residues = molecule.atoms, molecule.residues
+        self.molecule = molecule
+        self.table = table
+        self.color = molecule.color
+        self.atom_keys = array('i', [a.coordIndex for a in atoms])
+        self.residue_keys = array('i', [self.residue_key(r) for r in residues])
+        self.atom_colors = array('i', [intern(a.color) for a in atoms])
+        self.ribbons = array('i', [intern(r.ribbonColor) for r in residues])
+        self.fills = array('i', [intern(r.fillColor) for r in residues])
+        self.stale = False
+
+    @staticmethod
+    def atom_key(atom):
+        return atom.coordIndex
+
+    @staticmethod
+    def residue_key(residue):
+        atoms = residue.atoms
+        return atoms[0].coordIndex if atoms else -1
+
+    def positions(self, keys, current, key):
+        if not self.stale:
+            return izip(current, xrange(len(keys)))
+        index = dict((k, i) for (i, k) in enumerate(keys) if k >= 0)
+        pairs = ((obj, index.get(key(obj))) for obj in current)
+        return ((obj, i) for (obj, i) in pairs if i is not None)
+
+    def restore(self):
+        colors = self.table.colors
+        mol = self.molecule
+        mol.color = self.color
+        atom_colors = self.atom_colors
+        for a, i in self.positions(self.atom_keys, mol.atoms, self.atom_key):
+            a.color = colors[atom_colors[i]]
+        ribbons, fills = self.ribbons, self.fills
+        for r, i in self.positions(self.residue_keys, mol.residues, self.residue_key):
+            r.ribbonColor = colors[ribbons[i]]
+            r.fillColor = colors[fills[i]]
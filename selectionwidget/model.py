@@ -0,0 +1,977 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Tk-independent selection model, shared by `widgets.SelectionEntry`
+and headless (e.g. `chimera.nogui`) sessions.
+"""
+
+from __future__ import print_function, division
+# Python stdlib
+import re
+import time
+import json
+import logging
+import threading
+import Queue
+from bisect import bisect_right
+from contextlib import contextmanager
+from itertools import cycle, count
+from collections import OrderedDict, deque, namedtuple
+
+DEFERRED = object()
+ChangeSet = namedtuple('ChangeSet', 'added removed retagged')
+
+
+_QUOTES = '"\''
+_BRACKETS = {'(': ')', '[': ']'}
+_BRACKET_RE = re.compile(r'[()\[\]]')
+
+
+def token_pattern(separator=r'\s+'):
+    """
+    Compile the `(plain, separator)` regexes used by `tokenize`.
+    `plain` matches runs of characters that are neither separators
+    nor quote or bracket openers.
+    """
+    if separator == r'\s+':
+        # Runs of plain characters are matched in one go for the default separator
+        plain = r'[^\s"\'(\[]+'
+    else:
+        plain = r'(?:(?!{0})[^"\'(\[])+'.format(separator)
+    return re.compile(plain, re.DOTALL), re.compile(separator, re.DOTALL)
+
+
+def _match_brackets(content):
+    """
+    Map the offset of each bracket opener in `content` to the offset of
+    its closer, counting nesting depth. Unclosed openers are left out.
+    """
+    matches = {}
+    stacks = dict((closer, []) for closer in _BRACKETS.values())
+    for match in _BRACKET_RE.finditer(content):
+        char, pos = match.group(), match.start()
+        if char in _BRACKETS:
+            stacks[_BRACKETS[char]].append(pos)
+        elif stacks[char]:
+            matches[stacks[char].pop()] = pos
+    return matches
+
+
+def tokenize(content, pattern=None):
+    """
+    Yield `(text, sep, start, end)` for each spec in `content`, in a
+    single linear scan. `start` and `end` are the offsets of `text`.
+
+    Bracketed fragments are kept whole, even if they contain a
+    separator, and so are quoted ones, but only if the quote opens the
+    token: a quote inside a token is a plain character (primed atom
+    names such as `C1'`). Openers with no closer after them are plain
+    characters too.
+    """
+    plain, separator = pattern if pattern is not None else token_pattern()
+    plain, separator = plain.match, separator.match
+    last = dict((quote, content.rfind(quote)) for quote in _QUOTES)
+    brackets = _match_brackets(content)
+    size = len(content)
+    pos = 0
+    while pos < size:
+        # Leading separators belong to no token
+        match = separator(content, pos)
+        if match is not None and match.end() > pos:
+            pos = match.end()
+            continue
+        start = pos
+        while pos < size:
+            match = plain(content, pos)
+            if match is not None:
+                pos = match.end()
+            if pos >= size:
+                break
+            char = content[pos]
+            if char in _QUOTES:
+                pos = content.index(char, pos + 1) + 1 if pos == start and last[char] > pos else pos + 1
+            elif char in _BRACKETS:
+                pos = brackets.get(pos, pos) + 1
+            else:
+                break
+        end = pos
+        match = separator(content, pos)
+        if match is not None:
+            pos = match.end()
+        yield content[start:end], content[end:pos], start, end
+
+
+class SelectionModel(object):
+
+    """
+    Selection state parsed from a text buffer: the items, indexed by
+    object, with palette cycling, validation and callbacks.
+
+    A `view` (see `widgets.SelectionEntry`) owns the actual text and its
+    highlighting; without one, the model can be fed whole buffers with
+    `update()` and driven at full speed from scripts.
+    """
+
+    PALETTE = ('blue', 'red', 'purple', 'sienna', 'grey', 'green', 'turquoise', 'gold')
+    WRONG = 'wrong'
+    PENDING = 'pending'
+
+    def __init__(self, validator=None, splitter=r'\s+', item_creator=None, cache_size=1024,
+                 resolver=None, chunk_threshold=250, view=None, batch_validator=None):
+        # Callables
+        validator = validator if validator else self._identity
+        self.cache = (ValidationCache(validator, maxsize=cache_size, batch_validator=batch_validator)
+                      if cache_size else None)
+        self.validator = self.cache if self.cache is not None else validator
+        self.batch_validator = batch_validator
+        self.item_creator = item_creator if item_creator else SelectionItem
+        self.worker = ValidationWorker(resolver) if resolver else None
+        self.chunk_threshold = chunk_threshold
+        self.view = view
+        self.instrumentation = None
+
+        # Model
+        self.items = ItemStore()
+        self.objects = self.items.by_obj
+        self.colors = cycle(iter(self.PALETTE))
+
+        # Privates
+        self._re = token_pattern(splitter)
+        self._callbacks = []
+        self._clear_callbacks = []
+        self._change_callbacks = []
+        self._progress_callbacks = []
+        self._progress = [0, 0]
+        self._pending = {}
+        self._pending_keys = {}
+        self._deferred = deque()
+        self._job_ids = count()
+        self._lead = 0
+
+    def _identity(self, item):
+        return item
+
+    # Callbacks
+    def do_callbacks(self, *items):
+        if not items:
+            items = self.items
+        for fn in self._callbacks:
+            fn(*items)
+
+    def add_callback(self, fn):
+        self._callbacks.append(fn)
+
+    def do_clear_callbacks(self, *items):
+        if not items:
+            items = self.items
+        for fn in self._clear_callbacks:
+            fn(*items)
+
+    def add_clear_callback(self, fn):
+        self._clear_callbacks.append(fn)
+
+    def do_change_callbacks(self, changes):
+        for fn in self._change_callbacks:
+            fn(changes)
+
+    def add_change_callback(self, fn):
+        """
+        Register `fn(changes)` to receive one ChangeSet per update, with
+        the items added, removed and retagged by it.
+        """
+        self._change_callbacks.append(fn)
+
+    def do_progress_callbacks(self):
+        done, total = self._progress
+        for fn in self._progress_callbacks:
+            fn(done, total)
+        if done >= total:
+            self._progress = [0, 0]
+
+    def add_progress_callback(self, fn):
+        """
+        Register `fn(done, total)` to follow time-sliced validation jobs.
+        """
+        self._progress_callbacks.append(fn)
+
+    def notify(self, added=(), removed=(), retagged=()):
+        with self.timed('callbacks'):
+            removed = [item for item in removed if not item.pending]
+            if added or removed or retagged:
+                self.do_change_callbacks(ChangeSet(tuple(added), tuple(removed), tuple(retagged)))
+
+    def notify_all(self):
+        """
+        Whole-list protocol, kept for compatibility: add callbacks get
+        every item after each update pass. Pending items are left out
+        (reading their `ok` would validate them on the spot); they are
+        delivered with the whole list again once they resolve.
+        """
+        if self._callbacks:
+            with self.timed('callbacks'):
+                items = self._settled_items()
+                for fn in self._callbacks:
+                    fn(*items)
+
+    def _settled_items(self):
+        return [item for item in self.items if not item.pending]
+
+    # Instrumentation
+    def enable_instrumentation(self, window=512, log=False):
+        """
+        Start recording per-phase timings, see `Instrumentation`.
+        """
+        self.instrumentation = Instrumentation(window=window, log=log)
+        return self.instrumentation
+
+    def disable_instrumentation(self):
+        self.instrumentation = None
+
+    def timed(self, phase):
+        if self.instrumentation is None:
+            return NULL_PHASE
+        return self.instrumentation.phase(phase)
+
+    def timed_cycle(self, kind):
+        if self.instrumentation is None:
+            return NULL_PHASE
+        return self.instrumentation.cycle(kind)
+
+    def stats(self):
+        return {'phases': self.instrumentation.stats() if self.instrumentation is not None else {},
+                'cache': self.cache.stats() if self.cache is not None else None}
+
+    # Itemization
+    def update(self, content, callback=True, force=False):
+        """
+        Re-itemize from the whole buffer `content`, keeping the items of
+        unchanged leading and trailing tokens.
+        """
+        with self.timed_cycle('update'):
+            old_items = self.items
+            if callback and self._clear_callbacks:
+                settled = self._settled_items()
+                for fn in self._clear_callbacks:
+                    fn(*settled)
+            with self.timed('tokenize'):
+                tokens = list(tokenize(content, self._re))
+            self._lead = tokens[0][2] if tokens else 0
+
+            # Diff token texts against current items: unchanged head and tail are kept
+            with self.timed('diff'):
+                head = tail = 0
+                if not force:
+                    limit = min(len(old_items), len(tokens))
+                    while head < limit and old_items[head].text == tokens[head][0]:
+                        head += 1
+                    limit -= head
+                    while tail < limit and old_items[-1 - tail].text == tokens[-1 - tail][0]:
+                        tail += 1
+
+                added = [self.create_item(text=text, sep=sep)
+                         for text, sep, start, end in tokens[head:len(tokens) - tail]]
+                removed = self.items.splice(head, len(old_items) - tail, added)
+                for item in removed:
+                    self.unregister_item(item)
+                if force:
+                    self.reset_colors()
+                for item, (text, sep, start, end) in zip(self.items, tokens):
+                    item.sep, item.start, item.end = sep, start, end
+                self.items.invalidate_offsets()
+
+            with self.timed('validate'):
+                if self.worker is None and len(added) <= self.chunk_threshold:
+                    for item, obj in zip(added, self.validate_many([item.text for item in added])):
+                        self.resolve_item(item, obj)
+                else:
+                    # Large pastes are validated in time slices, see process_pending
+                    for item in added:
+                        self.submit_item(item)
+                    added = [item for item in added if not item.pending]
+
+            self.notify(added=added if callback else (), removed=removed)
+            if callback:
+                self.notify_all()
+
+    def revalidate(self, content, callback=True):
+        if self.cache is not None:
+            self.cache.invalidate()
+        self.update(content, callback=callback, force=True)
+
+    def rebuild_tags(self):
+        self.reset_colors()
+        retagged = []
+        for obj, sameitems in self.objects.items():
+            tag = self.next_color()
+            for item in sameitems:
+                if item.tag != tag:
+                    self.items.set_tag(item, tag)
+                    retagged.append(item)
+        self.notify(retagged=retagged)
+
+    def update_offsets(self, items=None, start=None):
+        """
+        Recompute character offsets of `items` (all by default), laid
+        out contiguously from offset `start` (after leading separators
+        by default).
+        """
+        if start is None:
+            start = self._lead
+        for item in (self.items if items is None else items):
+            item.start = start
+            item.end = start = start + len(item.text)
+            start += len(item.sep)
+        self.items.invalidate_offsets()
+        return start
+
+    def split_specs(self, content):
+        return [q for (text, sep, start, end) in tokenize(content, self._re) for q in (text, sep) if q]
+
+    def next_color(self):
+        return next(self.colors)
+
+    def reset_colors(self):
+        self.colors = cycle(iter(self.PALETTE))
+
+    def clear(self):
+        removed = [item for item in self.items if not item.pending]
+        self.cancel_pending()
+        self.items.clear()
+        self.do_clear_callbacks()
+        self.reset_colors()
+        if removed:
+            self.do_change_callbacks(ChangeSet((), tuple(removed), ()))
+
+    # Items
+    def create_item(self, text=None, sep=' ', obj=None):
+        return self.item_creator(text=text, sep=sep, obj=obj, validator=self.validator, parent=self)
+
+    def register_item(self, item):
+        if item.ok:
+            sameitems = self.objects.get(item.obj)
+            tag = next(iter(sameitems)).tag if sameitems else self.next_color()
+            self.items.link(item)
+        else:
+            tag = self.WRONG
+        self.items.set_tag(item, tag)
+
+    def unregister_item(self, item):
+        # The store already dropped it from its indices
+        if item.pending:
+            self.forget_pending(item)
+
+    def append_item(self, text=None, sep=' ', obj=None, start=None, callback=True):
+        item = self.create_item(text=text, sep=sep, obj=obj)
+        item.validate()
+        if start is not None:
+            self.update_offsets([item], start=start)
+        self.items.append(item)
+        self.register_item(item)
+        if callback:
+            self.notify(added=[item])
+            self.do_callbacks(item)
+        return item
+
+    def delete_item(self, item):
+        self.delete_items([item])
+
+    def delete_items(self, items):
+        """
+        Remove `items` in one pass: a single text edit, index update
+        and notification, no matter how many there are. Offsets are
+        only recomputed for the items after the first deleted one.
+        """
+        if self.view is not None:
+            self.view.sync()
+        doomed, seen = [], set()
+        for item in items:
+            if item in seen or item not in self.items:
+                continue
+            # Valid items take every occurrence of their text along
+            for other in (list(self.items.with_text(item.text)) if item.ok else [item]):
+                if other not in seen:
+                    seen.add(other)
+                    doomed.append(other)
+        if not doomed:
+            return
+        if self.view is not None:
+            self.view.delete_text(doomed)
+        first = min(self.items.index(item) for item in doomed)
+        self.items.remove_many(doomed)
+        # Text before the first deleted item is untouched: only shift what follows
+        previous = self.items[first - 1] if first else None
+        if previous is not None and previous.end is not None:
+            self.update_offsets(self.items[first:], previous.end + len(previous.sep))
+        else:
+            self.update_offsets()
+        self.notify(removed=doomed)
+
+    # Pending validation
+    @property
+    def has_pending(self):
+        return bool(self._pending)
+
+    def submit_item(self, item):
+        """
+        Queue `item` for validation in the worker thread, or in time
+        slices if there is no worker. Until its result arrives, the item
+        is pending and tagged as such.
+        """
+        if item.obj is not None:
+            return self.register_item(item)
+        key = next(self._job_ids)
+        item._ok = None
+        self.items.set_tag(item, self.PENDING)
+        self._pending[key] = item
+        self._pending_keys[item] = key
+        self._progress[1] += 1
+        if self.worker is None:
+            self._deferred.append(key)
+        else:
+            self.worker.submit(key, item.text)
+
+    def process_pending(self, budget=20):
+        """
+        Register the results posted by the worker and validate deferred
+        items for up to `budget` ms. Returns the resolved items.
+        """
+        with self.timed_cycle('validation'):
+            resolved = []
+            with self.timed('validate'):
+                for key, text, result in (self.worker.results() if self.worker is not None else ()):
+                    item = self._pending.get(key)
+                    if item is None or item.text != text:  # stale
+                        continue
+                    if result is DEFERRED:
+                        self._deferred.append(key)
+                        continue
+                    self.forget_pending(item)
+                    self.resolve_item(item, result)
+                    resolved.append(item)
+
+                # Tokens the worker cannot handle are validated here, time-sliced
+                deadline = time.time() + budget / 1000
+                size = self.chunk_threshold if self.batch_validator is not None else 1
+                while self._deferred and time.time() < deadline:
+                    keys = [self._deferred.popleft() for _ in range(min(size, len(self._deferred)))]
+                    batch = [self._pending[key] for key in keys if key in self._pending]
+                    for item, obj in zip(batch, self.validate_many([item.text for item in batch])):
+                        self.forget_pending(item)
+                        self.resolve_item(item, obj)
+                        resolved.append(item)
+
+            if resolved:
+                self.notify(added=resolved)
+                self.notify_all()
+            self.do_progress_callbacks()
+            return resolved
+
+    @property
+    def has_deferred(self):
+        return bool(self._deferred)
+
+    def forget_pending(self, item):
+        key = self._pending_keys.pop(item, None)
+        if key is not None:
+            del self._pending[key]
+            self._progress[0] += 1
+
+    def validate_many(self, texts):
+        """
+        Validate all `texts` at once, with a single `batch_validator`
+        call for those not cached, if there is one.
+        """
+        if not texts:
+            return []
+        if self.cache is not None:
+            return self.cache.batch(texts)
+        if self.batch_validator is not None:
+            return self.batch_validator(texts)
+        return [self.validator(text) for text in texts]
+
+    def resolve_item(self, item, obj):
+        item.obj = obj
+        item._ok = True if obj else False
+        self.register_item(item)
+
+    def resolve_pending(self):
+        """
+        Synchronously validate every pending item, dropping queued results.
+        """
+        items = [item for key, item in sorted(self._pending.items())]
+        self.cancel_pending()
+        for item, obj in zip(items, self.validate_many([item.text for item in items])):
+            self.resolve_item(item, obj)
+        if items:
+            self.notify(added=items)
+            self.notify_all()
+            self._progress = [len(items), len(items)]
+            self.do_progress_callbacks()
+        return items
+
+    def cancel_pending(self):
+        self._pending.clear()
+        self._pending_keys.clear()
+        self._deferred.clear()
+        self._progress = [0, 0]
+        if self.worker is not None:
+            self.worker.discard()
+
+    def stop(self):
+        self.cancel_pending()
+        if self.worker is not None:
+            self.worker.stop()
+
+
+class _NullPhase(object):
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_PHASE = _NullPhase()
+
+
+def _percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+class Instrumentation(object):
+
+    """
+    Opt-in wall-clock timing of the phases of each update cycle.
+
+    The last `window` durations of each phase are kept to compute
+    rolling percentiles. Phases can nest (e.g. `depict` runs inside
+    `callbacks`), so their times are inclusive. With `log` set, each
+    outermost cycle emits one JSON line to the `selectionwidget` logger.
+    """
+
+    def __init__(self, window=512, log=False, logger=None):
+        self.window = window
+        self.log = log
+        self.logger = logger if logger is not None else logging.getLogger('selectionwidget')
+        self._samples = {}
+        self._counts = {}
+        self._cycle = None
+
+    @contextmanager
+    def phase(self, name):
+        t0 = time.time()
+        try:
+            yield
+        finally:
+            self.record(name, (time.time() - t0) * 1000)
+
+    @contextmanager
+    def cycle(self, kind):
+        outermost = self._cycle is None
+        if outermost:
+            self._cycle = {}
+        t0 = time.time()
+        try:
+            yield
+        finally:
+            if outermost:
+                phases, self._cycle = self._cycle, None
+                total = (time.time() - t0) * 1000
+                self.record('cycle:' + kind, total)
+                if self.log:
+                    self.logger.info(json.dumps({'cycle': kind, 'total_ms': round(total, 3),
+                                                 'phases': dict((k, round(v, 3)) for (k, v) in phases.items())},
+                                                sort_keys=True))
+
+    def record(self, name, ms):
+        samples = self._samples.get(name)
+        if samples is None:
+            samples = self._samples[name] = deque(maxlen=self.window)
+        samples.append(ms)
+        self._counts[name] = self._counts.get(name, 0) + 1
+        if self._cycle is not None:
+            self._cycle[name] = self._cycle.get(name, 0) + ms
+
+    def stats(self):
+        """
+        Count and rolling mean/p50/p90/p99/max, in ms, for each phase.
+        """
+        stats = {}
+        for name, samples in self._samples.items():
+            ordered = sorted(samples)
+            stats[name] = {'count': self._counts[name], 'last_ms': samples[-1],
+                           'mean_ms': sum(ordered) / len(ordered),
+                           'p50_ms': _percentile(ordered, 50), 'p90_ms': _percentile(ordered, 90),
+                           'p99_ms': _percentile(ordered, 99), 'max_ms': ordered[-1]}
+        return stats
+
+    def reset(self):
+        self._samples.clear()
+        self._counts.clear()
+
+
+class ItemStore(object):
+
+    """
+    Items in buffer order, indexed by position, text, object and tag.
+
+    `by_obj` maps each object to the ordered set of valid items that
+    resolved to it (an OrderedDict with None values); `by_text` and
+    `by_tag` map to plain sets. Hash indices are updated in O(1) per item;
+    positions are recomputed lazily after the order changes. Removed
+    items leave a hole (None) behind, so removal is O(1) per item too;
+    holes are compacted on the next positional access, from the first
+    one on.
+    """
+
+    def __init__(self):
+        self._items = []
+        self._positions = {}
+        self._stale = False
+        self._starts = None
+        self._holes = 0
+        self._first_hole = None
+        self.by_text = {}
+        self.by_obj = OrderedDict()
+        self.by_tag = {}
+
+    def __iter__(self):
+        if self._holes:
+            return (item for item in self._items if item is not None)
+        return iter(self._items)
+
+    def __len__(self):
+        return len(self._items) - self._holes
+
+    def __getitem__(self, index):
+        self._compact()
+        return self._items[index]
+
+    def __contains__(self, item):
+        return item in self._positions
+
+    def _index(self, item):
+        self._positions[item] = None
+        self.by_text.setdefault(item.text, set()).add(item)
+        if item.tag is not None:
+            self.by_tag.setdefault(item.tag, set()).add(item)
+
+    def _unindex(self, item):
+        del self._positions[item]
+        self._discard(self.by_text, item.text, item)
+        self._discard(self.by_tag, item.tag, item)
+        self.unlink(item)
+
+    @staticmethod
+    def _discard(index, key, item):
+        bucket = index.get(key)
+        if bucket is not None:
+            bucket.discard(item)
+            if not bucket:
+                del index[key]
+
+    def _dirty(self):
+        self._stale = True
+        self._starts = None
+
+    def _slot(self, item):
+        """
+        Position of `item` in the list, holes included.
+        """
+        if self._stale:
+            self._positions = dict((it, i) for (i, it) in enumerate(self._items) if it is not None)
+            self._stale = False
+        return self._positions[item]
+
+    def _compact(self):
+        if not self._holes:
+            return
+        start = self._first_hole
+        tail = [item for item in self._items[start:] if item is not None]
+        self._items[start:] = tail
+        if not self._stale:
+            for i, item in enumerate(tail, start):
+                self._positions[item] = i
+        self._holes = 0
+        self._first_hole = None
+        self._starts = None
+
+    def append(self, item):
+        self._items.append(item)
+        self._index(item)
+        self._positions[item] = len(self._items) - 1
+        self._starts = None
+
+    def splice(self, start, stop, items=()):
+        """
+        Replace the items in positions [start:stop] by `items`, returning
+        the removed ones.
+        """
+        self._compact()
+        removed = self._items[start:stop]
+        for item in removed:
+            self._unindex(item)
+        self._items[start:stop] = items
+        for item in items:
+            self._index(item)
+        self._dirty()
+        return removed
+
+    def remove(self, item):
+        self.remove_many([item])
+
+    def remove_many(self, items):
+        for item in set(items):
+            slot = self._slot(item)
+            self._unindex(item)
+            self._items[slot] = None
+            self._holes += 1
+            if self._first_hole is None or slot < self._first_hole:
+                self._first_hole = slot
+        self._starts = None
+
+    def clear(self):
+        del self._items[:]
+        self._positions.clear()
+        self._stale = False
+        self._holes = 0
+        self._first_hole = None
+        self.by_text.clear()
+        self.by_obj.clear()
+        self.by_tag.clear()
+        self._starts = None
+
+    def index(self, item):
+        self._compact()
+        return self._slot(item)
+
+    def at_offset(self, offset):
+        """
+        Item spanning character `offset` (separator included), if any.
+        """
+        self._compact()
+        if self._starts is None:
+            self._starts = [item.start for item in self._items]
+        i = bisect_right(self._starts, offset) - 1
+        if i >= 0:
+            item = self._items[i]
+            if item.start is not None and offset < item.end + len(item.sep):
+                return item
+
+    def with_text(self, text):
+        return self.by_text.get(text, ())
+
+    def with_obj(self, obj):
+        return self.by_obj.get(obj, ())
+
+    def with_tag(self, tag):
+        return self.by_tag.get(tag, ())
+
+    def set_tag(self, item, tag):
+        if item in self._positions:
+            self._discard(self.by_tag, item.tag, item)
+            if tag is not None:
+                self.by_tag.setdefault(tag, set()).add(item)
+        item.tag = tag
+
+    def link(self, item):
+        """
+        Index a valid item by its object.
+        """
+        self.by_obj.setdefault(item.obj, OrderedDict())[item] = None
+
+    def unlink(self, item):
+        sameitems = self.by_obj.get(item.obj)
+        if sameitems is not None and item in sameitems:
+            del sameitems[item]
+            if not sameitems:
+                del self.by_obj[item.obj]
+
+    def invalidate_offsets(self):
+        self._starts = None
+
+
+class ValidationCache(object):
+
+    """
+    Bounded LRU memoization of a validator callable.
+
+    Results are keyed on the stripped spec text and the current
+    `generation`, which must be bumped with `invalidate()` whenever
+    the objects the validator resolves against change. Texts for which
+    `volatile(text)` is true are never cached.
+    """
+
+    def __init__(self, validator, maxsize=1024, batch_validator=None, volatile=None):
+        self.validator = validator
+        self.batch_validator = batch_validator
+        self.volatile = volatile
+        self.maxsize = maxsize
+        self.generation = 0
+        self.hits = self.misses = self.evictions = 0
+        self._data = OrderedDict()
+
+    def __call__(self, text):
+        if self.volatile is not None and self.volatile(text):
+            return self.validator(text)
+        key = text.strip(), self.generation
+        try:
+            result = self._data.pop(key)
+        except KeyError:
+            self.misses += 1
+            result = self.validator(text)
+            self._evict()
+        else:
+            self.hits += 1
+        self._data[key] = result
+        return result
+
+    def batch(self, texts):
+        """
+        Same as calling the cache on each of `texts`, but all misses are
+        validated with a single `batch_validator` call, if there is one.
+        """
+        if self.batch_validator is None:
+            return [self(text) for text in texts]
+        volatile = self.volatile
+        missing = OrderedDict()
+        for text in texts:
+            key = text.strip(), self.generation
+            if key not in self._data:
+                missing.setdefault(key, text)
+        found = dict(zip(missing, self.batch_validator(list(missing.values())))) if missing else {}
+        self.misses += len(found)
+        for key, result in found.items():
+            if volatile is not None and volatile(key[0]):
+                continue
+            self._data.pop(key, None)
+            self._evict()
+            self._data[key] = result
+        results = []
+        for text in texts:
+            key = text.strip(), self.generation
+            if key in found:
+                results.append(found[key])
+            else:
+                results.append(self(text))
+        return results
+
+    def _evict(self):
+        if len(self._data) >= self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def __len__(self):
+        return len(self._data)
+
+    def invalidate(self, *args):
+        self.generation += 1
+        self._data.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'size': len(self._data), 'maxsize': self.maxsize, 'generation': self.generation}
+
+
+class ValidationWorker(object):
+
+    """
+    Runs `resolver` over submitted spec texts in a daemon thread.
+
+    `resolver` must be thread-safe: it should only read pure-data
+    indices and return the resolved object, None if the text is not
+    valid, or DEFERRED to request validation in the Tk thread.
+    Results are collected from the Tk thread with `results()`.
+    """
+
+    def __init__(self, resolver):
+        self.resolver = resolver
+        self._jobs = Queue.Queue()
+        self._results = Queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='SelectionValidationWorker')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            key, text = self._jobs.get()
+            if key is None:
+                break
+            try:
+                result = self.resolver(text)
+            except Exception:
+                result = DEFERRED
+            self._results.put((key, text, result))
+
+    def submit(self, key, text):
+        self._jobs.put((key, text))
+
+    def results(self):
+        while True:
+            try:
+                yield self._results.get_nowait()
+            except Queue.Empty:
+                return
+
+    def discard(self):
+        for queue in (self._jobs, self._results):
+            while True:
+                try:
+                    queue.get_nowait()
+                except Queue.Empty:
+                    break
+
+    def stop(self):
+        self.discard()
+        self._jobs.put((None, None))
+
+
+class SelectionItem(object):
+
+    __slots__ = ('parent', 'text', 'sep', 'start', 'end', 'tag', 'obj', 'validator', '_ok')
+
+    def __init__(self, text=None, sep=' ', tag=None, obj=None, validator=None, parent=None,
+                 start=None, end=None):
+        self.parent = parent
+        self.text = text
+        self.sep = sep
+        self.start = start
+        self.end = end
+        self.tag = tag
+        self.obj = obj
+        self.validator = validator
+        if obj:
+            self._ok = True 
+            if text is None:
+                self.text = self.specifier(obj)
+        else:
+            self._ok = False
+
+    def validate(self):
+        if self.obj is None:
+            self.obj = self.validator(self.text)
+            self._ok = True if self.obj else False
+
+    @property
+    def pending(self):
+        return self._ok is None
+
+    @property
+    def ok(self):
+        if self._ok is None:
+            self.validate()
+        return self._ok
+
+    def __str__(self):
+        return self.text + self.sep
+
+    @staticmethod
+    def specifier(obj):
+        return str(obj)
+
+    def delete(self):
+        self.parent.delete_item(self)
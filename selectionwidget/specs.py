@@ -0,0 +1,426 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+
+from __future__ import print_function, division 
+# Python stdlib
+import re
+from math import floor
+# Chimera stuff
+import chimera
+from chimera.specifier import evalSpec
+# Own
+from .model import SelectionModel, SelectionItem, DEFERRED
+
+"""
+Resolution of Chimera specs into atoms, residues or molecules, with no
+Tk dependencies, so it can also run in chimera.nogui sessions
+"""
+
+
+class ChimeraSelectionModel(SelectionModel):
+
+    """
+    A `SelectionModel` whose items are Chimera objects of a single
+    `mode`, validated with the spec index, the spatial index and
+    `evalSpec`. It keeps no track of open models by itself: call
+    `rebuild_spec_index` after opening or closing any, or let a
+    `gui.ChimeraSelectionEntry` follow the triggers.
+    """
+
+    allowed_modes = ('atoms', 'bonds', 'residues', 'chains', 'molecules')
+    # Specs that can be evaluated one molecule at a time
+    PLAIN_SPEC = re.compile(r'^[\w#:.@,*?\-]+$')
+    # Mid-edit or all-wildcard tokens that cannot name a single object
+    # (a trailing `.` is fine after a residue: `:12.` is the blank chain)
+    UNFINISHED_SPEC = re.compile(r'[#:@,&|~\-]$|(?:^#\d+|@\S*)\.$|^[#:@]?\**$')
+    # Within-distance zones: `:LIG z<4`, `(sel za<5)`
+    ZONE_SPEC = re.compile(r'^\(?\s*(?P<base>\S+?)\s*(?P<kind>za|zr|z)<\s*(?P<distance>\d+(?:\.\d*)?)\s*\)?$')
+    # Specs that depend on the current selection, which must not be cached
+    SELECTION_SPEC = re.compile(r'\bsel\b')
+    # Single-residue specs that validate_batch resolves by itself
+    RESIDUE_SPEC = re.compile(r'^(?:#(\d+))?:(-?\d+)(?:\.(\w*))?(?:@(\w+))?$')
+
+    def __init__(self, mode='atoms', **kwargs):
+        if mode not in self.allowed_modes:
+            raise ValueError('mode must be one of {}'.format(self.allowed_modes))
+        self.mode = mode
+        self.spec_index = SpecIndex(mode)
+        self.spatial = SpatialIndex()
+        self.specifiers = SpecifierCache()
+        kwargs.setdefault('validator', self.validate)
+        kwargs.setdefault('resolver', self.resolve)
+        kwargs.setdefault('batch_validator', self.validate_batch)
+        kwargs.setdefault('item_creator', ChimeraItem)
+        SelectionModel.__init__(self, **kwargs)
+        if self.cache is not None:
+            self.cache.volatile = self.SELECTION_SPEC.search
+        self.rebuild_spec_index()
+
+    # Validation
+    def validate(self, query):
+        obj = self.spec_index.lookup(query)
+        if obj is not None:
+            return obj
+        if not self.plausible_spec(query):
+            return
+        try:
+            zone = self.ZONE_SPEC.match(query.strip())
+            if zone is not None and self.mode in ('atoms', 'residues', 'molecules'):
+                with self.timed('zone'):
+                    return self.zone_match(zone.group('base'), float(zone.group('distance')),
+                                           residues=zone.group('kind') != 'za')
+            with self.timed('evalSpec'):
+                return self.single_match(query.strip())
+        except:  # Syntax error, etc
+            return
+
+    def validate_batch(self, queries):
+        """
+        Validate all `queries` in one go. Canonical specs are looked up
+        in the index; other single-residue specs are grouped by residue
+        position and resolved in one walk over the open molecules;
+        anything else, or anything that matched nothing, goes through
+        `validate`.
+        """
+        with self.timed('validate_batch'):
+            results = [None] * len(queries)
+            groups, found, rest = {}, {}, []
+            for i, query in enumerate(queries):
+                query = query.strip()
+                obj = self.spec_index.lookup(query)
+                if obj is not None:
+                    results[i] = obj
+                    continue
+                match = self.RESIDUE_SPEC.match(query)
+                if match is None or self.mode not in ('atoms', 'residues'):
+                    rest.append(i)
+                    continue
+                model, position, chain, name = match.groups()
+                groups.setdefault(int(position), []).append(
+                    (i, None if model is None else int(model), chain, name))
+                found[i] = []
+
+            if groups:
+                for mol in chimera.openModels.list(modelTypes=[chimera.Molecule]):
+                    for res in mol.residues:
+                        entries = groups.get(res.id.position)
+                        if entries is None:
+                            continue
+                        for i, model, chain, name in entries:
+                            if (model is not None and model != mol.id) or len(found[i]) > 1:
+                                continue
+                            if chain is not None and res.id.chainId.strip() != chain:
+                                continue
+                            atoms = [a for a in res.atoms if name is None or a.name == name]
+                            if self.mode == 'atoms':
+                                found[i].extend(atoms)
+                            elif atoms:
+                                found[i].append(res)
+
+            for i, objs in found.items():
+                if len(objs) == 1:
+                    results[i] = objs[0]
+                elif not objs:
+                    rest.append(i)
+            for i in rest:
+                results[i] = self.validate(queries[i])
+            return results
+
+    def plausible_spec(self, query):
+        query = query.strip()
+        return not (self.UNFINISHED_SPEC.search(query)
+                    or query.count('(') != query.count(')')
+                    or query.count('[') != query.count(']'))
+
+    def single_match(self, query):
+        """
+        The only object of the current mode selected by `query`, if any.
+        Plain specs are evaluated one molecule at a time, giving up as
+        soon as a second match turns up.
+        """
+        if not self.PLAIN_SPEC.match(query):
+            sel = evalSpec(query)
+            current = getattr(sel, self.mode)() if sel else ()
+            return current[0] if len(current) == 1 else None
+        found = None
+        for mol in self.spec_molecules(query):
+            sel = evalSpec(query, models=[mol])
+            current = getattr(sel, self.mode)() if sel else ()
+            if len(current) > 1 or (current and found is not None):
+                return
+            if current:
+                found = current[0]
+        return found
+
+    def zone_match(self, base, distance, residues=True):
+        """
+        The only object of the current mode within `distance` of what
+        `base` selects, answered with the spatial index.
+        """
+        reference = self.spec_index.lookup(base)
+        if reference is not None:
+            reference = [reference] if isinstance(reference, chimera.Atom) else reference.atoms
+        else:
+            sel = evalSpec(base)
+            reference = sel.atoms() if sel else []
+        if not reference:
+            return
+        atoms = self.spatial.zone(reference, distance, residues=residues)
+        if self.mode == 'atoms':
+            found = atoms
+        else:
+            found = set(getattr(a, 'residue' if self.mode == 'residues' else 'molecule') for a in atoms)
+        if len(found) == 1:
+            return next(iter(found))
+
+    def spec_molecules(self, query):
+        molecules = chimera.openModels.list(modelTypes=[chimera.Molecule])
+        model = re.match(r'#(\d+)(?=[:@]|$)', query)
+        if model is not None:
+            molecules = [m for m in molecules if m.id == int(model.group(1))]
+        return molecules
+
+    def resolve(self, query):
+        # Runs in the validation worker: no Chimera calls allowed here!
+        obj = self.spec_index.lookup(query)
+        return DEFERRED if obj is None else obj
+
+    def rebuild_spec_index(self, *args):
+        index = SpecIndex(self.mode)
+        index.add(*chimera.openModels.list(modelTypes=[chimera.Molecule]))
+        self.spec_index = index
+
+
+class SpecIndex(object):
+
+    """
+    Resolves the canonical specs written by `ChimeraItem.specifier`
+    (`#model:pos.chain@name`, `#model:pos.chain`, `#model`) with dict
+    lookups, keeping one table per molecule so models can be indexed
+    and dropped on their own. Anything else is left to `evalSpec`.
+    """
+
+    AMBIGUOUS = object()
+    CANONICAL = re.compile(r'^#(\d+):(-?\d+)\.(\w*)(?:@([^\s@:#.,;]+))?$|^#(\d+)$')
+
+    def __init__(self, mode='atoms'):
+        self.mode = mode
+        self.molecules = {}
+        self._by_id = {}  # replaced, not mutated, so the worker can read it safely
+
+    def add(self, *molecules):
+        for mol in molecules:
+            self.molecules[mol] = self.table(mol)
+        self._reindex()
+
+    def remove(self, *molecules):
+        for mol in molecules:
+            self.molecules.pop(mol, None)
+        self._reindex()
+
+    def table(self, mol):
+        if self.mode == 'atoms':
+            pairs = (((a.residue.id.position, a.residue.id.chainId.strip(), a.name), a) for a in mol.atoms)
+        elif self.mode == 'residues':
+            pairs = (((r.id.position, r.id.chainId.strip()), r) for r in mol.residues)
+        elif self.mode == 'molecules':
+            pairs = [((), mol)]
+        else:
+            pairs = ()
+        # Alternate locations and insertion codes share keys: leave those to evalSpec
+        table = {}
+        for key, obj in pairs:
+            table[key] = self.AMBIGUOUS if key in table else obj
+        return table
+
+    def _reindex(self):
+        by_id = {}
+        for mol, table in self.molecules.items():
+            by_id.setdefault(mol.id, []).append(table)
+        self._by_id = by_id
+
+    def key(self, query):
+        match = self.CANONICAL.match(query.strip())
+        if match is None:
+            return None, None
+        model, position, chain, name, model_only = match.groups()
+        if model_only is not None:
+            return int(model_only), ()
+        if self.mode == 'atoms' and name is not None:
+            return int(model), (int(position), chain, name)
+        if self.mode == 'residues' and name is None:
+            return int(model), (int(position), chain)
+        return None, None
+
+    def lookup(self, query):
+        """
+        The object `query` stands for, or None if it is not a canonical
+        spec or does not match exactly one object.
+        """
+        model, key = self.key(query)
+        if key is None:
+            return
+        found = [table[key] for table in self._by_id.get(model, ()) if key in table]
+        if len(found) == 1 and found[0] is not self.AMBIGUOUS:
+            return found[0]
+
+
+class SpatialGrid(object):
+
+    """
+    Uniform cell grid over the atoms of a molecule, in the molecule's
+    own coordinate frame, so within-distance queries only visit the
+    cells around each query point.
+    """
+
+    def __init__(self, atoms, cell=4.0):
+        self.cell = cell
+        self.cells = {}
+        for a in atoms:
+            c = a.coord()
+            key = int(floor(c.x / cell)), int(floor(c.y / cell)), int(floor(c.z / cell))
+            self.cells.setdefault(key, []).append((a, c.x, c.y, c.z))
+
+    def within(self, points, distance):
+        """
+        Atoms closer than `distance` to any of `points`, (x, y, z)
+        tuples in the molecule frame.
+        """
+        cell = self.cell
+        reach = int(floor(distance / cell)) + 1
+        cutoff = distance * distance
+        buckets = {}
+        for p in points:
+            key = int(floor(p[0] / cell)), int(floor(p[1] / cell)), int(floor(p[2] / cell))
+            buckets.setdefault(key, []).append(p)
+        found = set()
+        span = range(-reach, reach + 1)
+        for (i, j, k), bucket in buckets.items():
+            for di in span:
+                for dj in span:
+                    for dk in span:
+                        for a, x, y, z in self.cells.get((i + di, j + dj, k + dk), ()):
+                            if a in found:
+                                continue
+                            for px, py, pz in bucket:
+                                if (x - px) ** 2 + (y - py) ** 2 + (z - pz) ** 2 <= cutoff:
+                                    found.add(a)
+                                    break
+        return found
+
+
+class SpatialIndex(object):
+
+    """
+    One `SpatialGrid` per open molecule, built on first use and
+    dropped whenever its coordinates may have changed.
+    """
+
+    def __init__(self):
+        self.grids = {}
+
+    def grid(self, mol):
+        grid = self.grids.get(mol)
+        if grid is None:
+            grid = self.grids[mol] = SpatialGrid(mol.atoms)
+        return grid
+
+    def zone(self, atoms, distance, residues=False):
+        """
+        `atoms` plus every atom within `distance` of them, in any open
+        molecule, extended to whole residues if `residues` is set.
+        """
+        points = [a.xformCoord() for a in atoms]
+        found = set(atoms)
+        for mol in chimera.openModels.list(modelTypes=[chimera.Molecule]):
+            to_local = mol.openState.xform.inverse()
+            local = [to_local.apply(p) for p in points]
+            found.update(self.grid(mol).within([(p.x, p.y, p.z) for p in local], distance))
+        if residues:
+            found = set(a for r in set(a.residue for a in found) for a in r.atoms)
+        return found
+
+    def forget(self, *molecules):
+        for mol in molecules:
+            self.grids.pop(mol, None)
+
+    def clear(self):
+        self.grids.clear()
+
+
+class SpecifierCache(object):
+
+    """
+    Canonical specifier prefixes of residues, formatted for a whole
+    molecule at once the first time one of its objects needs a
+    specifier, and kept until the molecule is forgotten. Atom
+    specifiers are then just the residue prefix plus the atom name.
+    An uncached instance formats the prefixes on every call instead.
+    """
+
+    def __init__(self, cached=True):
+        self.cached = cached
+        self.molecules = {}
+
+    def prefixes(self, residue):
+        mol = residue.molecule
+        if not self.cached:
+            return self.format(mol.id, residue)
+        table = self.molecules.get(mol)
+        if table is None:
+            table = self.molecules[mol] = self.build(mol)
+        try:
+            return table[residue]
+        except KeyError:  # created after the molecule was formatted
+            prefixes = table[residue] = self.format(mol.id, residue)
+            return prefixes
+
+    def atom(self, atom):
+        return self.prefixes(atom.residue)[1] + atom.name
+
+    def residue(self, residue):
+        return self.prefixes(residue)[0]
+
+    @classmethod
+    def build(cls, mol):
+        model = mol.id
+        return dict((r, cls.format(model, r)) for r in mol.residues)
+
+    @staticmethod
+    def format(model, residue):
+        rid = residue.id
+        spec = '#{}:{}.{}'.format(model, rid.position, rid.chainId)
+        return spec, '#{}:{}.{}@'.format(model, rid.position, rid.chainId.strip())
+
+    def forget(self, *molecules):
+        for mol in molecules:
+            self.molecules.pop(mol, None)
+
+    def clear(self):
+        self.molecules.clear()
+
+
+UNCACHED_SPECIFIERS = SpecifierCache(cached=False)
+
+
+class ChimeraItem(SelectionItem):
+
+    __slots__ = ()
+
+    def __init__(self, text=None, obj=None, parent=None, **kwargs):
+        specifiers = getattr(parent, 'specifiers', None)
+        if text is None and obj and specifiers is not None:
+            text = self.specifier(obj, specifiers)
+        SelectionItem.__init__(self, text=text, obj=obj, parent=parent, **kwargs)
+
+    @staticmethod
+    def specifier(obj, specifiers=UNCACHED_SPECIFIERS):
+        if isinstance(obj, chimera.Atom):
+            return specifiers.atom(obj)
+        elif isinstance(obj, chimera.Molecule):
+            return '#{}'.format(obj.id)
+        elif isinstance(obj, chimera.Residue):
+            return specifiers.residue(obj)
+        elif isinstance(obj, chimera.Bond):
+            pass
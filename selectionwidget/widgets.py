@@ -6,9 +6,11 @@ from __future__ import print_function, division
 # Python stdlib
 import Tkinter as tk
 import string
-import re
-from itertools import cycle
-from collections import OrderedDict
+import time
+# Own
+from .model import (SelectionModel, SelectionItem, ItemStore, ValidationCache, ValidationWorker,
+                    Instrumentation, ChangeSet, DEFERRED, token_pattern, tokenize)
+
 
 class SelectionEntry(tk.Text):
     
@@ -22,194 +24,383 @@ class SelectionEntry(tk.Text):
                     'Shift_R', 'Super_L', 'Super_R', 'Up')
     _NORMAL_KEYS = string.letters + string.digits + '@:./-;,!?_'
     
-    PALETTE = ('blue', 'red', 'purple', 'sienna', 'grey', 'green', 'turquoise', 'gold')
+    PALETTE = SelectionModel.PALETTE
     PALETTE_HEX = ('#0000ff', '#ff0000', '#a020f0', '#a0522d',
                    '#708090', '#00ff00', '#40e0d0', '#ffd700')
-    WRONG = 'wrong'
+    WRONG = SelectionModel.WRONG
+    PENDING = SelectionModel.PENDING
 
-    def __init__(self, parent=None, validator=None, splitter=r'(\s+)', item_creator=None, **kwargs):
+    def __init__(self, parent=None, validator=None, splitter=r'\s+', item_creator=None,
+                 quiet_period=150, max_latency=500, cache_size=1024, resolver=None,
+                 poll_interval=20, validation_budget=20, chunk_threshold=250, model=None,
+                 batch_validator=None, **kwargs):
         # Init and configure base widget
         tk.Text.__init__(self, parent, **kwargs)
         self.configure(**self._STYLE)
-        
-        # Callables
-        self.validator = validator if validator else self._identity
-        self.item_creator = item_creator
 
         # Model
-        self.items = []
-        self.objects = OrderedDict()
+        if model is None:
+            model = SelectionModel(validator=validator, splitter=splitter, item_creator=item_creator,
+                                   cache_size=cache_size, resolver=resolver,
+                                   chunk_threshold=chunk_threshold, batch_validator=batch_validator)
+        self.model = model
+        self.model.view = self
+
+        # Scheduler, in milliseconds
+        self.quiet_period = quiet_period
+        self.max_latency = max_latency
+        self.poll_interval = poll_interval
+        self.validation_budget = validation_budget
 
-        # Tags & Markers
-        self.colors = cycle(iter(self.PALETTE))
+        # Tags
         self.tag_config(self.WRONG, background='red', foreground='white')
+        self.tag_config(self.PENDING, foreground='#a0a0a0')
         for name, color in zip(self.PALETTE, self.PALETTE_HEX):
             self.tag_config(name, foreground=color)
-        self.reset_highlight_marks()
 
         # Privates
-        self._re = re.compile(splitter)
-        self._callbacks = []
-        self._clear_callbacks = []
+        self._itemize_job = None
+        self._pending_since = None
+        self._poll_job = None
+        self._painted = None
+        self._content = None
 
         # Triggers
         self.bind('<KeyRelease>', self.on_key_release)
 
-    def _identity(self, item):
-        return item
+    # Model delegation
+    @property
+    def items(self):
+        return self.model.items
+
+    @property
+    def objects(self):
+        return self.model.objects
+
+    @property
+    def cache(self):
+        return self.model.cache
+
+    @property
+    def validator(self):
+        return self.model.validator
+
+    @property
+    def batch_validator(self):
+        return self.model.batch_validator
+
+    @property
+    def worker(self):
+        return self.model.worker
+
+    @property
+    def item_creator(self):
+        return self.model.item_creator
+
+    @item_creator.setter
+    def item_creator(self, value):
+        self.model.item_creator = value
 
-    def on_key_release(self, event=None):
-        if event.keysym in self._SPECIAL_KEYS:
-            return
-        self.itemize()
-        
     def do_callbacks(self, *items):
-        if not items:
-            items = self.items
-        for fn in self._callbacks:
-            fn(*items)
+        self.model.do_callbacks(*items)
 
     def add_callback(self, fn):
-        self._callbacks.append(fn)
+        self.model.add_callback(fn)
 
     def do_clear_callbacks(self, *items):
-        if not items:
-            items = self.items
-        for fn in self._clear_callbacks:
-            fn(*items)
+        self.model.do_clear_callbacks(*items)
 
     def add_clear_callback(self, fn):
-        self._clear_callbacks.append(fn)
-
-    def itemize(self, a=None, b=None, c=None, highlight=True, callback=True):
-        self.clear_items()
-        specs = self.split_specs()
-        for spec, sep in map(None, specs[::2], specs[1::2]):
-            sep = sep if sep else ''
-            self.add_item(text=spec, sep=sep, highlight=False, callback=False)
-        if highlight:
-            self.highlight_all_text()
-        if callback:
-            self.do_callbacks()
+        self.model.add_clear_callback(fn)
+
+    def add_change_callback(self, fn):
+        self.model.add_change_callback(fn)
+
+    def add_progress_callback(self, fn):
+        self.model.add_progress_callback(fn)
+
+    def next_color(self):
+        return self.model.next_color()
+
+    def enable_instrumentation(self, window=512, log=False):
+        return self.model.enable_instrumentation(window=window, log=log)
+
+    def disable_instrumentation(self):
+        self.model.disable_instrumentation()
+
+    def timed(self, phase):
+        return self.model.timed(phase)
+
+    def timed_cycle(self, kind):
+        return self.model.timed_cycle(kind)
+
+    def stats(self):
+        return self.model.stats()
+
+    def reset_colors(self):
+        self.model.reset_colors()
+
+    # Events & scheduling
+    def on_key_release(self, event=None):
+        if event.keysym in self._SPECIAL_KEYS:
+            return
+        self.schedule_itemize()
+
+    def schedule_itemize(self):
+        """
+        Coalesce bursts of edits into a single itemize pass, run after
+        `quiet_period` ms without new input, but never later than
+        `max_latency` ms after the first pending edit.
+        """
+        now = time.time()
+        if self._pending_since is None:
+            self._pending_since = now
+        if self._itemize_job is not None:
+            self.after_cancel(self._itemize_job)
+        remaining = self.max_latency - (now - self._pending_since) * 1000
+        delay = int(max(0, min(self.quiet_period, remaining)))
+        if delay:
+            self._itemize_job = self.after(delay, self.run_itemize)
+        else:
+            self._itemize_job = self.after_idle(self.run_itemize)
+
+    def cancel_itemize(self):
+        if self._itemize_job is not None:
+            self.after_cancel(self._itemize_job)
+        self._itemize_job = None
+        self._pending_since = None
+
+    def run_itemize(self):
+        """
+        Run the debounced itemize pass. Large pastes are left to the
+        background validation, see `flush` to resolve them right away.
+        """
+        self.cancel_itemize()
+        self.itemize()
+
+    def flush(self):
+        """
+        Run the pending itemize pass and the pending validations right now, if any.
+        """
+        if self._itemize_job is not None:
+            self.cancel_itemize()
+            self.itemize()
+        if self.model.has_pending:
+            self.resolve_pending()
+
+    def sync(self):
+        """
+        Bring items and their offsets up to date with the text, running
+        any pending itemize pass now. Call before editing at stored offsets.
+        """
+        if self._itemize_job is not None or self.get(1.0, 'end-1c') != self._content:
+            self.cancel_itemize()
+            self.itemize()
+
+    def destroy(self):
+        self.cancel_itemize()
+        self.cancel_validation()
+        self.model.stop()
+        tk.Text.destroy(self)
+
+    def itemize(self, a=None, b=None, c=None, highlight=True, callback=True, force=False):
+        with self.timed_cycle('itemize'):
+            content = self.get(1.0, 'end-1c')
+            if content != self._content:
+                self.invalidate_highlight()
+                self._content = content
+            self.model.update(content, callback=callback, force=force)
+            if highlight:
+                self.highlight_all_text()
+            self.schedule_validation()
+
+    def revalidate(self, *args):
+        if self.cache is not None:
+            self.cache.invalidate()
+        self.itemize(force=True)
 
     def rebuild_tags(self):
-        self.reset_colors()
-        for item in self.items:
-            item.tag = self.next_color()
-        self.highlight_all_text()
+        with self.timed_cycle('rebuild_tags'):
+            self.model.rebuild_tags()
+            self.highlight_all_text()
+
+    # Background validation
+    def schedule_validation(self):
+        if self.model.has_pending and self._poll_job is None:
+            self._poll_job = self.after(self.poll_interval, self.poll_validation)
+
+    def poll_validation(self):
+        self._poll_job = None
+        with self.timed_cycle('validation'):
+            if self.model.process_pending(self.validation_budget):
+                self.highlight_all_text()
+        if self.model.has_pending:
+            delay = 1 if self.model.has_deferred else self.poll_interval
+            self._poll_job = self.after(delay, self.poll_validation)
+
+    def resolve_pending(self):
+        self.cancel_validation(discard=False)
+        if self.model.resolve_pending():
+            self.highlight_all_text()
 
+    def cancel_validation(self, discard=True):
+        if self._poll_job is not None:
+            self.after_cancel(self._poll_job)
+        self._poll_job = None
+        if discard:
+            self.model.cancel_pending()
+
+    # Highlighting
     def highlight(self, item, start=None):
+        if start is None and item.start is not None:
+            self.tag_add(item.tag, self.text_index(item.start), self.text_index(item.end))
+            return
         if start is None:
             start = self.search(item.text, 1.0, stopindex='end')
-        if start is not None:
+        if start:
             self.tag_add(item.tag, start, '{}+{}c'.format(start, len(item.text)))
-    
+
     def highlight_all_matches(self, item, start=None):
-        start = start if start is not None else 1.0
-        while True:
-            pos = self.search(item.text, start, stopindex='end')
-            if not pos:
-                break
-            self.tag_add(item.tag, pos, '{}+{}c'.format(pos, len(item.text)))
-    
+        start = int(start) if start is not None else 0
+        for other in self.items.with_text(item.text):
+            if other.start is not None and other.start >= start:
+                self.tag_add(item.tag, self.text_index(other.start), self.text_index(other.end))
+
     def highlight_all_text(self):
-        self.clear_highlight()
-        self.reset_highlight_marks()
-        for item in self.items:
-            self.mark_set('hl_end', 'hl_start+{}c'.format(len(item.text)))
-            self.highlight(item, 'hl_start')
-            self.mark_set('hl_start', 'hl_end+{}c'.format(len(item.sep)))
-    
+        """
+        Repaint all items with one multi-range tag_remove/tag_add per tag,
+        skipping tags whose ranges have not changed since the last paint.
+        """
+        with self.timed('highlight'):
+            self._highlight_all_text()
+
+    def _highlight_all_text(self):
+        wanted = {}
+        for tag, tagged in self.items.by_tag.items():
+            ranges = sorted((item.start, item.end) for item in tagged if item.start is not None)
+            if ranges:
+                wanted[tag] = [offset for pair in ranges for offset in pair]
+        painted = self._painted
+        tags = set(wanted).union(self.tag_names() if painted is None else painted)
+        tags.discard('sel')
+        for tag in tags:
+            ranges = wanted.get(tag, [])
+            if painted is None:
+                self.tag_remove_ranges(tag, 1.0, 'end')
+            else:
+                old = painted.get(tag, [])
+                if old == ranges:
+                    continue
+                if old:
+                    self.tag_remove_ranges(tag, 1.0, 'end')
+            if ranges:
+                self.tag_add(tag, *map(self.text_index, ranges))
+        self._painted = wanted
+
     def clear_highlight(self):
-        for tag in self.tag_names():
-            self.tag_remove(tag, 1.0, 'end')
+        tags = self.tag_names() if self._painted is None else self._painted.keys()
+        for tag in tags:
+            self.tag_remove_ranges(tag, 1.0, 'end')
+        self._painted = {}
+
+    def tag_remove_ranges(self, tag, *indices):
+        # Tkinter's tag_remove only takes a single range
+        self.tk.call(self._w, 'tag', 'remove', tag, *indices)
+
+    def invalidate_highlight(self):
+        """
+        Forget the painted tag state, e.g. after the text was edited.
+        """
+        self._painted = None
+
+    @staticmethod
+    def text_index(offset):
+        return '1.0+{}c'.format(offset)
+
+    def update_offsets(self, items=None, start=None):
+        return self.model.update_offsets(items, start)
 
     @property
     def content(self):
         return self.get(1.0, 'end-1c').strip('\n')
     
-    def split_specs(self):
-        return [q for q in self._re.split(self.content) if q]
+    def split_specs(self, content=None):
+        if content is None:
+            content = self.content
+        return self.model.split_specs(content)
 
-    def next_color(self):
-        return next(self.colors)
+    # Items
+    def clear_items(self):
+        self.cancel_validation()
+        self.model.clear()
 
-    def reset_colors(self):
-        self.colors = cycle(iter(self.PALETTE))
-    
-    def reset_highlight_marks(self):
-        self.mark_set('hl_start', '1.0')
-        self.mark_set('hl_end', 'end')
+    def create_item(self, text=None, sep=' ', obj=None):
+        return self.model.create_item(text=text, sep=sep, obj=obj)
 
-    def clear_items(self):
-        self.items = []
-        self.objects.clear()
-        self.do_clear_callbacks()
-        self.reset_colors()
+    def register_item(self, item):
+        self.model.register_item(item)
+
+    def unregister_item(self, item):
+        self.model.unregister_item(item)
 
     def add_item(self, text=None, sep=' ', obj=None, highlight=True, insert=False, callback=True):
-        item = self.item_creator(text=text, sep=sep, obj=obj, validator=self.validator, parent=self)
-        item.validate()
-        if item.ok:
-            try:
-                sameitems = self.objects[item.obj]
-            except KeyError:
-                self.objects[item.obj] = [item]
-                item.tag = self.next_color()
-            else:
-                sameitems.append(item)
-                item.tag = sameitems[0].tag
-        else:
-            item.tag = self.WRONG
-        self.items.append(item)
+        start = None
+        if insert:
+            self.sync()
+            self.invalidate_highlight()
+            # Appended at the end so text and item order stay in sync
+            if self.items and not self.items[-1].sep:
+                self.items[-1].sep = ' '
+                self.insert('end-1c', ' ')
+            start = len(self.get('1.0', 'end-1c'))
+        item = self.model.append_item(text=text, sep=sep, obj=obj, start=start, callback=False)
         if insert:
-            self.insert('insert', item.text + item.sep)
+            self.insert('end-1c', item.text + item.sep)
+            self._content = self.get(1.0, 'end-1c')
         if highlight:
             self.highlight(item)
         if callback:
+            self.model.notify(added=[item])
             self.do_callbacks(item)
+        return item
 
+    def add_items(self, objs, highlight=True, callback=True):
+        """
+        Append one item per object in `objs` at the end of the text,
+        with a single text insertion and a single notification.
+        """
+        objs = list(objs)
+        if not objs:
+            return []
+        self.sync()
+        self.invalidate_highlight()
+        if self.items and not self.items[-1].sep:
+            self.items[-1].sep = ' '
+            self.insert('end-1c', ' ')
+        start = len(self.get('1.0', 'end-1c'))
+        items = []
+        for obj in objs:
+            item = self.model.append_item(obj=obj, start=start, callback=False)
+            start = item.end + len(item.sep)
+            items.append(item)
+        self.insert('end-1c', ''.join(item.text + item.sep for item in items))
+        self._content = self.get(1.0, 'end-1c')
+        if highlight:
+            self.highlight_all_text()
+        if callback:
+            self.model.notify(added=items)
+            self.do_callbacks(*items)
+        return items
 
-class SelectionItem(object):
-
-    def __init__(self, text=None, sep=' ', tag=None, obj=None, validator=None, parent=None):
-        self.parent = parent
-        self.text = text
-        self.sep = sep
-        self.tag = tag
-        self.obj = obj
-        self.validator = validator
-        if obj:
-            self._ok = True 
-            if text is None:
-                self.text = self.specifier(obj)
-        else:
-            self._ok = False
-
-    def validate(self):
-        if self.obj is None:
-            self.obj = self.validator(self.text)
-            self._ok = True if self.obj else False
+    def delete_items(self, items):
+        self.model.delete_items(items)
 
-    @property
-    def ok(self):
-        if self._ok is None:
-            self.validate()
-        return self._ok
-
-    def __str__(self):
-        return self.text + self.sep
-
-    def specifier(self, obj):
-        return str(obj)
-
-    def delete(self):
-        print('Deleting', repr(self))
-        self.parent.items.remove(self)
-        if self.ok:
-            while True:
-                pos = self.parent.search(self.text, 1.0, stopindex='end')
-                if not pos:
-                    break
-                self.parent.delete(pos, '{}+{}c'.format(pos, len(self.text) + len(self.sep)))
-            del self.parent.objects[self.obj]
+    def delete_text(self, items):
+        """
+        Remove the text spanned by `items`, separators included.
+        """
+        self.invalidate_highlight()
+        for item in sorted(items, key=lambda item: item.start, reverse=True):
+            if item.start is not None:
+                self.delete(self.text_index(item.start), self.text_index(item.end + len(item.sep)))
+        self._content = self.get(1.0, 'end-1c')
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Tests for `ChimeraSelectionEntry`, on the stub Tk backend and the
+stand-in `chimera` package used by the benchmarks.
+"""
+
+from __future__ import print_function, division
+import os
+import sys
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BENCHMARKS = os.path.join(HERE, os.pardir, 'benchmarks')
+sys.path[:0] = [BENCHMARKS, os.path.join(BENCHMARKS, 'fakechimera')]
+
+import faketk
+faketk.install()
+import chimera
+from chimera import synthetic
+from selectionwidget.gui import ChimeraSelectionEntry
+
+
+class ChimeraEntryTest(unittest.TestCase):
+
+    def setUp(self):
+        chimera.triggers = chimera.TriggerSet()
+        self.molecules = [synthetic.build_molecule(id=i, chains=2, residues=20, atoms=4)
+                          for i in range(3)]
+        chimera.openModels.add(self.molecules)
+        del chimera._commands[:]
+
+    def tearDown(self):
+        chimera.openModels.reset()
+        chimera.selection.clearCurrent()
+        del chimera._commands[:]
+
+    def entry(self, mode):
+        entry = ChimeraSelectionEntry(mode=mode, respond_to_focus=False)
+        self.addCleanup(entry.destroy)
+        return entry
+
+    def test_residue_groups_are_colored_with_one_command(self):
+        entry = self.entry('residues')
+        mol = self.molecules[1]
+        residues = mol.residues[:3] + mol.residues[5:6] + mol.residues[20:22] + self.molecules[2].residues[:1]
+        before = [a.color for r in residues for a in r.atoms]
+        entry.paint_groups({'red': (residues, [a for r in residues for a in r.atoms])})
+        self.assertEqual(chimera._commands, ['color red,a #1:1-3.A,6.A,1-2.B | #2:1.A'])
+        self.assertEqual([a.color for r in residues for a in r.atoms], before)
+
+    def test_molecule_groups_are_colored_with_one_command(self):
+        entry = self.entry('molecules')
+        molecules = [self.molecules[2], self.molecules[0]]
+        entry.paint_groups({'blue': (molecules, [a for m in molecules for a in m.atoms])})
+        self.assertEqual(chimera._commands, ['color blue,a #0,2'])
+
+    def test_depict_issues_one_command_per_color(self):
+        entry = self.entry('residues')
+        mol = self.molecules[0]
+        item = entry.create_item(obj=mol.residues[4])
+        entry.register_item(item)
+        del chimera._commands[:]
+        entry.depict(item)
+        self.assertEqual(chimera._commands, ['color {},a #0:5.A'.format(item.tag)])
+
+    def test_atoms_are_painted_one_by_one(self):
+        entry = self.entry('atoms')
+        atoms = self.molecules[0].atoms[:5]
+        entry.paint_groups({'red': (atoms, atoms)})
+        self.assertEqual(chimera._commands, [])
+        red = entry.material_color('red')
+        self.assertTrue(all(a.color is red for a in atoms))
+
+    def test_shared_model_ids_fall_back_to_atoms(self):
+        twin = synthetic.build_molecule(id=1, chains=1, residues=2, atoms=2)
+        chimera.openModels.add([twin])
+        entry = self.entry('molecules')
+        entry.paint_groups({'red': ([twin], twin.atoms)})
+        self.assertEqual(chimera._commands, [])
+
+    def test_snapshots_keep_no_object_references(self):
+        entry = self.entry('atoms')
+        entry.desaturate()
+        snapshot = entry._snapshots[self.molecules[0]]
+        self.assertFalse([name for name in snapshot.__slots__
+                          if isinstance(getattr(snapshot, name), (list, tuple))])
+
+    def test_stale_snapshots_restore_by_key(self):
+        mol = self.molecules[0]
+        atoms = dict((a, a.color) for a in mol.atoms)
+        residues = dict((r, (r.ribbonColor, r.fillColor)) for r in mol.residues)
+        entry = self.entry('atoms')
+        entry.desaturate()
+        residue = mol.residues[3]
+        new = chimera.Atom('HX', residue, (0, 0, 0), 9999)
+        new.color = 'new'
+        mol.atoms.insert(5, new)
+        residue.atoms.append(new)
+        gone = mol.atoms.pop(30)
+        newres = chimera.Residue(mol, 99, 'Z')
+        newres.ribbonColor = 'new'
+        mol.residues.insert(0, newres)
+        chimera.triggers.activateTrigger('Atom', chimera._Changes(created=[new], deleted=[gone]))
+        chimera.triggers.activateTrigger('Residue', chimera._Changes(created=[newres]))
+        entry.resaturate()
+        self.assertTrue(all(a.color is atoms[a] for a in mol.atoms if a is not new))
+        self.assertTrue(all((r.ribbonColor, r.fillColor) == residues[r] for r in mol.residues if r is not newres))
+        self.assertEqual((new.color, newres.ribbonColor), ('new', 'new'))
+
+    def test_colour_changes_keep_the_specifier_caches(self):
+        entry = self.entry('atoms')
+        mol = self.molecules[0]
+        entry.specifiers.atom(mol.atoms[0])
+        generation = entry.cache.generation
+        chimera.triggers.activateTrigger('Model', chimera._Changes(modified=[mol], reasons=['color changed']))
+        chimera.triggers.activateTrigger('Residue', chimera._Changes(modified=mol.residues,
+                                                                     reasons=['ribbonColor changed']))
+        self.assertIn(mol, entry.specifiers.molecules)
+        self.assertEqual(entry.cache.generation, generation)
+
+    def test_renumbering_drops_the_specifier_caches(self):
+        entry = self.entry('atoms')
+        mol = self.molecules[0]
+        residue = mol.residues[0]
+        atom = residue.atoms[0]
+        entry.specifiers.atom(atom)
+        generation = entry.cache.generation
+        residue.id.position = 99
+        chimera.triggers.activateTrigger('Residue', chimera._Changes(modified=[residue], reasons=['id changed']))
+        self.assertNotIn(mol, entry.specifiers.molecules)
+        self.assertGreater(entry.cache.generation, generation)
+        self.assertEqual(entry.specifiers.atom(atom), '#0:99.A@N')
+        self.assertIs(entry.validate('#0:99.A@N'), atom)
+
+    def test_refocus_follows_camera_moves(self):
+        entry = self.entry('atoms')
+        moves = []
+        zone = entry.spatial.zone
+        entry.spatial.zone = lambda *args, **kwargs: moves.append(args) or zone(*args, **kwargs)
+        chimera.selection.addCurrent(self.molecules[0].atoms[:3])
+        entry.refocus()
+        center, size = chimera.viewer.camera.center, chimera.viewer.viewSize
+        entry.refocus()
+        self.assertEqual(len(moves), 1)
+        chimera.viewer.camera.center, chimera.viewer.viewSize = (1e3, 0, 0), 1
+        entry.refocus()
+        self.assertEqual(len(moves), 2)
+        self.assertEqual((chimera.viewer.camera.center, chimera.viewer.viewSize), (center, size))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Tests for the Tk-independent selection model. Run with
+`python -m unittest discover tests` (Python 2.7).
+"""
+
+from __future__ import print_function, division
+import time
+import unittest
+
+from selectionwidget.model import (SelectionModel, SelectionItem, ItemStore, ValidationCache,
+                                   token_pattern, tokenize)
+
+
+def alpha(text):
+    return text.upper() if text.isalpha() else None
+
+
+class TokenizeTest(unittest.TestCase):
+
+    def texts(self, content, separator=r'\s+'):
+        return [text for text, sep, start, end in tokenize(content, token_pattern(separator))]
+
+    def test_offsets(self):
+        content = '  ab  cd e'
+        for text, sep, start, end in tokenize(content):
+            self.assertEqual(content[start:end], text)
+        self.assertEqual(self.texts(content), ['ab', 'cd', 'e'])
+
+    def test_quotes_and_brackets_are_kept_whole(self):
+        self.assertEqual(self.texts(':12 "a b" (#0 za<5) [x y]z'),
+                         [':12', '"a b"', '(#0 za<5)', '[x y]z'])
+
+    def test_custom_separator(self):
+        self.assertEqual(self.texts('a b;c', separator=';'), ['a b', 'c'])
+
+    def test_primed_atom_names(self):
+        self.assertEqual(self.texts("#0:1.A@C1' #0:1.A@C2' :12@O4'"),
+                         ["#0:1.A@C1'", "#0:1.A@C2'", ":12@O4'"])
+        self.assertEqual(self.texts("@C1' 'a b'"), ["@C1'", "'a b'"])
+
+    def test_nested_brackets(self):
+        self.assertEqual(self.texts('(x (y) z) [a [b] c]d (e'), ['(x (y) z)', '[a [b] c]d', '(e'])
+
+    def test_unclosed_openers_are_plain(self):
+        self.assertEqual(self.texts('(a b "c d'), ['(a', 'b', '"c', 'd'])
+
+    def assertLinear(self, build, tokens):
+        def elapsed(n):
+            content = build(n)
+            t0 = time.time()
+            self.assertEqual(len(self.texts(content)), tokens(n))
+            return time.time() - t0
+        small, large = elapsed(5000), elapsed(40000)
+        # Quadratic rescans would take ~64 times longer
+        self.assertLess(large, max(small, 0.01) * 24)
+
+    def test_unclosed_openers_are_linear(self):
+        self.assertLinear(lambda n: ' '.join(['(x'] * n), lambda n: n)
+        self.assertLinear(lambda n: ' '.join(['"x'] * n), lambda n: n // 2 + n % 2)
+
+    def test_leading_separators_are_linear(self):
+        self.assertLinear(lambda n: ' ' * (20 * n) + 'x', lambda n: 1)
+
+
+class ItemStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.store = ItemStore()
+        self.items = [SelectionItem(text=t) for t in ('a', 'b', 'a', 'c')]
+        for item in self.items:
+            self.store.append(item)
+
+    def test_indices(self):
+        a1, b, a2, c = self.items
+        self.assertEqual(self.store.with_text('a'), set([a1, a2]))
+        self.assertEqual([self.store.index(item) for item in self.items], [0, 1, 2, 3])
+        self.store.set_tag(b, 'red')
+        self.assertEqual(self.store.with_tag('red'), set([b]))
+
+    def test_splice(self):
+        a1, b, a2, c = self.items
+        d = SelectionItem(text='d')
+        self.assertEqual(self.store.splice(1, 3, [d]), [b, a2])
+        self.assertEqual(list(self.store), [a1, d, c])
+        self.assertEqual(self.store.index(c), 2)
+        self.assertNotIn(b, self.store)
+        self.assertEqual(self.store.with_text('a'), set([a1]))
+
+    def test_remove_many(self):
+        a1, b, a2, c = self.items
+        self.store.remove_many([a2, b])
+        self.assertEqual(len(self.store), 2)
+        self.assertEqual(list(self.store), [a1, c])
+        self.assertNotIn(b, self.store)
+        self.assertEqual(self.store.with_text('b'), ())
+        self.assertEqual(self.store.index(c), 1)
+        self.assertEqual(self.store[-1], c)
+
+    def test_removals_between_positional_access(self):
+        items = [SelectionItem(text=str(i)) for i in range(10)]
+        for item in items:
+            self.store.append(item)
+        for item in items[::3]:
+            self.store.remove(item)
+        self.store.remove(self.items[1])
+        expected = [self.items[0], self.items[2], self.items[3]] + [it for it in items if it not in items[::3]]
+        self.assertEqual(list(self.store), expected)
+        self.assertEqual([self.store.index(item) for item in expected], list(range(len(expected))))
+        self.assertEqual(self.store[3:5], expected[3:5])
+
+    def test_at_offset(self):
+        start = 0
+        for item in self.items:
+            item.start, item.end = start, start + len(item.text)
+            start = item.end + len(item.sep)
+        self.assertIs(self.store.at_offset(0), self.items[0])
+        self.assertIs(self.store.at_offset(1), self.items[0])  # separator
+        self.assertIs(self.store.at_offset(6), self.items[3])
+
+
+class UpdateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.model = SelectionModel(validator=self.validate)
+        self.changes = []
+        self.model.add_change_callback(self.changes.append)
+
+    def validate(self, text):
+        self.calls.append(text)
+        return alpha(text)
+
+    def test_offsets_and_objects(self):
+        self.model.update('  ab 12 cd')
+        self.assertEqual([(i.text, i.start, i.end, i.obj) for i in self.model.items],
+                         [('ab', 2, 4, 'AB'), ('12', 5, 7, None), ('cd', 8, 10, 'CD')])
+        self.assertEqual(list(self.model.objects), ['AB', 'CD'])
+        self.assertEqual(self.model.items[1].tag, SelectionModel.WRONG)
+
+    def test_head_and_tail_are_kept(self):
+        self.model.update('ab cd ef')
+        head, middle, tail = self.model.items
+        del self.calls[:]
+        self.model.update('ab xy zw ef')
+        self.assertEqual(self.calls, ['xy', 'zw'])
+        items = list(self.model.items)
+        self.assertIs(items[0], head)
+        self.assertIs(items[-1], tail)
+        self.assertEqual([i.text for i in items], ['ab', 'xy', 'zw', 'ef'])
+        self.assertEqual(self.changes[-1].removed, (middle,))
+        self.assertEqual([i.text for i in self.changes[-1].added], ['xy', 'zw'])
+        self.assertEqual(items[-1].start, 9)
+
+    def test_force_replaces_everything(self):
+        self.model.update('ab cd')
+        old = list(self.model.items)
+        self.model.revalidate('ab cd')
+        self.assertFalse(set(old) & set(self.model.items))
+
+    def test_delete_items(self):
+        self.model.update('ab cd ab ef')
+        ab = self.model.items[0]
+        self.model.delete_items([ab])
+        self.assertEqual([(i.text, i.start) for i in self.model.items], [('cd', 0), ('ef', 3)])
+        self.assertNotIn('AB', self.model.objects)
+
+    def test_whole_list_callbacks(self):
+        seen = []
+        self.model.add_callback(lambda *items: seen.append([i.text for i in items]))
+        self.model.update('ab cd')
+        self.model.update('ab cd ef')
+        self.assertEqual(seen[-1], ['ab', 'cd', 'ef'])
+
+    def test_whole_list_callbacks_respect_callback_flag(self):
+        cleared = []
+        self.model.add_clear_callback(lambda *items: cleared.append(len(items)))
+        self.model.update('ab cd')
+        self.model.update('ab cd ef', callback=False)
+        self.model.update('ab')
+        self.assertEqual(cleared, [0, 3])
+
+    def test_whole_list_callbacks_skip_pending_items(self):
+        seen = []
+        self.model.chunk_threshold = 1
+        self.model.add_callback(lambda *items: seen.append([i.text for i in items]))
+        self.model.update('ab cd')
+        self.assertEqual(seen, [[]])
+        self.assertEqual(self.calls, [])
+        while self.model.has_pending:
+            self.model.process_pending(budget=1000)
+        self.assertEqual(seen[-1], ['ab', 'cd'])
+
+
+class ValidationCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.single, self.batches = [], []
+        self.cache = ValidationCache(self.validate, maxsize=3)
+
+    def validate(self, text):
+        self.single.append(text)
+        return alpha(text)
+
+    def validate_batch(self, texts):
+        self.batches.append(list(texts))
+        return [alpha(text) for text in texts]
+
+    def test_hits_are_keyed_on_stripped_text(self):
+        self.assertEqual([self.cache(t) for t in ('ab', ' ab', 'ab ', '1')], ['AB', 'AB', 'AB', None])
+        self.assertEqual(self.single, ['ab', '1'])
+        self.assertEqual(self.cache.stats()['hits'], 2)
+
+    def test_batch_validates_misses_once(self):
+        self.cache.batch_validator = self.validate_batch
+        self.assertEqual(self.cache.batch(['ab', 'cd', ' ab', '1']), ['AB', 'CD', 'AB', None])
+        self.assertEqual(self.batches, [['ab', 'cd', '1']])
+        self.assertEqual(self.cache.batch(['cd', '1']), ['CD', None])
+        self.assertEqual(len(self.batches), 1)
+        self.assertEqual(self.single, [])
+
+    def test_batch_without_batch_validator(self):
+        self.assertEqual(self.cache.batch(['ab', 'ab', '1']), ['AB', 'AB', None])
+        self.assertEqual(self.single, ['ab', '1'])
+
+    def test_invalidate(self):
+        self.cache('ab')
+        self.cache.invalidate()
+        self.cache('ab')
+        self.assertEqual(self.single, ['ab', 'ab'])
+
+    def test_eviction(self):
+        for text in ('ab', 'cd', 'ef', 'gh'):
+            self.cache(text)
+        self.assertEqual(len(self.cache), 3)
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+        self.cache('ab')
+        self.assertEqual(self.single[-1], 'ab')
+
+    def test_volatile_texts_are_not_cached(self):
+        self.cache.batch_validator = self.validate_batch
+        self.cache.volatile = lambda text: text.startswith('sel')
+        self.cache.batch(['sel', 'ab'])
+        self.cache('sel')
+        self.assertEqual(len(self.cache), 1)
+        self.assertEqual((self.batches, self.single), ([['sel', 'ab']], ['sel']))
+
+
+class PendingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.model = SelectionModel(validator=alpha, chunk_threshold=2)
+        self.progress = []
+        self.model.add_progress_callback(lambda done, total: self.progress.append((done, total)))
+
+    def test_large_updates_are_queued(self):
+        self.model.update('ab cd ef 12')
+        self.assertTrue(self.model.has_pending)
+        self.assertTrue(all(item.pending for item in self.model.items))
+        self.assertEqual(self.model.items[0].tag, SelectionModel.PENDING)
+        resolved = []
+        while self.model.has_pending:
+            resolved.extend(self.model.process_pending(budget=1000))
+        self.assertEqual(len(resolved), 4)
+        self.assertEqual(list(self.model.objects), ['AB', 'CD', 'EF'])
+        self.assertEqual(self.progress[-1], (4, 4))
+
+    def test_stale_items_are_dropped(self):
+        self.model.update('ab cd ef')
+        self.model.update('xy')
+        self.model.process_pending(budget=1000)
+        self.assertFalse(self.model.has_pending)
+        self.assertEqual(list(self.model.objects), ['XY'])
+
+    def test_resolve_pending(self):
+        self.model.update('ab cd ef')
+        self.assertEqual(len(self.model.resolve_pending()), 3)
+        self.assertFalse(self.model.has_pending)
+        self.assertFalse(any(item.pending for item in self.model.items))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Tests for the Chimera spec resolution, against the stand-in `chimera`
+package used by the benchmarks. No Tk display is needed.
+"""
+
+from __future__ import print_function, division
+import os
+import sys
+import subprocess
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FAKECHIMERA = os.path.join(HERE, os.pardir, 'benchmarks', 'fakechimera')
+sys.path.insert(0, FAKECHIMERA)
+
+import chimera
+from chimera import synthetic
+from selectionwidget.specs import ChimeraSelectionModel, ChimeraItem, SpecIndex
+
+
+class SpecsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.molecules = [synthetic.build_molecule(id=i, chains=2, residues=20, atoms=4)
+                          for i in range(2)]
+        chimera.openModels.add(self.molecules)
+
+    def tearDown(self):
+        chimera.openModels.reset()
+
+    def test_specifiers(self):
+        mol = self.molecules[1]
+        residue = mol.residues[3]
+        atom = residue.atoms[1]
+        self.assertEqual(ChimeraItem.specifier(mol), '#1')
+        self.assertEqual(ChimeraItem.specifier(residue), '#1:4.A')
+        self.assertEqual(ChimeraItem.specifier(atom), '#1:4.A@CA')
+        model = ChimeraSelectionModel(mode='atoms')
+        self.assertEqual(ChimeraItem.specifier(atom, model.specifiers), '#1:4.A@CA')
+        self.assertIn(mol, model.specifiers.molecules)
+
+    def test_validate(self):
+        model = ChimeraSelectionModel(mode='atoms')
+        atom = self.molecules[0].residues[25].atoms[2]
+        self.assertIs(model.validate('#0:6.B@C'), atom)
+        self.assertIsNone(model.validate(':6@C'))  # one per model and chain
+        self.assertIsNone(model.validate('#0:6.B@'))
+
+    def test_validate_batch(self):
+        model = ChimeraSelectionModel(mode='residues')
+        residue = self.molecules[1].residues[2]
+        queries = ['#1:3.A', '#1:3', ':3.A', '#9:3.A', ' #1:3.A ']
+        self.assertEqual(model.validate_batch(queries), [residue, None, None, None, residue])
+        self.assertEqual(model.validate_batch(queries), [model.validate(q) for q in queries])
+
+    def test_unfinished_specs(self):
+        model = ChimeraSelectionModel(mode='residues')
+        for query in ('#', '#0:', '#0:1-', '#0.', ':*', '#0:1@'):
+            self.assertFalse(model.plausible_spec(query), query)
+        for query in ('#0:1', '#0:12.', ':12.A', '#0:1@CA'):
+            self.assertTrue(model.plausible_spec(query), query)
+
+    def test_duplicate_keys_are_ambiguous(self):
+        residue = self.molecules[0].residues[0]
+        twin = chimera.Residue(self.molecules[0], residue.id.position, residue.id.chainId)
+        self.molecules[0].residues.append(twin)
+        index = SpecIndex('residues')
+        index.add(*self.molecules)
+        self.assertIsNone(index.lookup('#0:1.A'))
+        self.assertIs(index.lookup('#0:2.A'), self.molecules[0].residues[1])
+
+    def test_model_items(self):
+        model = ChimeraSelectionModel(mode='molecules')
+        model.update('#1 #5')
+        model.resolve_pending()
+        self.assertEqual([item.obj for item in model.items], [self.molecules[1], None])
+        self.assertIsInstance(model.items[0], ChimeraItem)
+        model.stop()
+
+    def test_no_tk(self):
+        code = ('import sys; import selectionwidget.specs; '
+                'sys.exit("Tkinter" in sys.modules or "selectionwidget.gui" in sys.modules)')
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join([FAKECHIMERA, os.path.join(HERE, os.pardir)]))
+        self.assertEqual(subprocess.call([sys.executable, '-c', code], env=env), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()